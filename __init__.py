@@ -18,12 +18,19 @@ metadata = MetaData(
 db =SQLAlchemy(metadata=metadata)
 DB_NAME= "database.db"
 
-def create_app():
+def create_app(test_config=None):
+    """`test_config` overrides the settings below, e.g. the database of a test run."""
     app = Flask(__name__)
     UPLOAD_FOLDER = path.join(app.root_path, 'static', 'media')
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Bodies past this are refused before they are read, uploads set tighter limits
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # None, 'x-sendfile' or 'x-accel-redirect' (with MEDIA_ACCEL_PREFIX), see media_serving.py
+    app.config['MEDIA_OFFLOAD'] = None
     app.config['SECRET_KEY']= '#TODO'
     app.config['SQLALCHEMY_DATABASE_URI']=f'sqlite:///{DB_NAME}'
+    if test_config is not None:
+        app.config.update(test_config)
     db.init_app(app)
     app.json.sort_keys = False
 
@@ -45,11 +52,28 @@ def create_app():
     app.register_blueprint(upload, url_prefix='/')
     app.register_blueprint(pull, url_prefix='/')
 
+    from .gacha_simulation import simulate_command
+    app.cli.add_command(simulate_command)
+    from .search_index import rebuild_search_command
+    app.cli.add_command(rebuild_search_command)
+
 
     from .models import User
 
     create_database(app)
 
+    from .cache_versions import init_cache_versions
+    init_cache_versions(app)
+
+    from .search_index import init_search_index
+    init_search_index(app)
+
+    from .autocomplete import build_autocomplete
+    build_autocomplete(app)
+
+    from .media_index import start_media_reconciler
+    start_media_reconciler(app)
+
     login_manager=LoginManager()
     login_manager.login_view='auth.login'
     login_manager.init_app(app)
@@ -58,11 +82,17 @@ def create_app():
     def load_user(id):
         return User.query.get(int(id))
 
-    migrate = Migrate(app, db, render_as_batch=True)
+    from .search_index import include_object
+    migrate = Migrate(app, db, render_as_batch=True, include_object=include_object)
 
     return app
 
 def create_database(app):
+    if app.config.get('TESTING'):
+        # A test database starts out empty
+        with app.app_context():
+            db.create_all()
+        return
     basedir = path.abspath(path.join(path.dirname(__file__), '..'))
     db_path = path.join(basedir, 'instance', DB_NAME)
     #print("Checking DB at:", path.abspath(db_path))
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, flash
 from website.models import User, db
 from website.decorators import admin_required
+from website import counters
 from flask_login import current_user, login_required
 
 
@@ -38,9 +39,7 @@ def add_votes(user_id, count):
         flash("You are not authorized to perform this action.", "danger")
         return redirect(url_for("views.home"))
     user = User.query.get_or_404(user_id)
-    user.votes_remaining = (user.votes_remaining or 0) + count
-    if(user.votes_remaining<0):
-        user.votes_remaining=0
+    counters.add(User.votes_remaining, user.id, count, floor=0)
     db.session.commit()
 
     flash(f"Added {count} votes to {user.name}.", "success")
@@ -54,9 +53,7 @@ def add_tokens(user_id, count):
         flash("You are not authorized to perform this action.", "danger")
         return redirect(url_for("index"))
     user = User.query.get_or_404(user_id)
-    user.tokens = (user.tokens or 0) + count
-    if(user.tokens<0):
-        user.tokens=0
+    counters.add(User.tokens, user.id, count, floor=0)
     db.session.commit()
 
     flash(f"Added {count} tokens to {user.name}.", "success")
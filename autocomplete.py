@@ -0,0 +1,146 @@
+from bisect import bisect_left, insort
+from sqlalchemy import event, inspect, select, literal
+from sqlalchemy.orm import Session as OrmSession
+from threading import Lock
+from slugify import slugify
+from .models import MODELS
+from .manage_entries import get_label_column
+from . import db
+
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+
+class PrefixIndex:
+    """Sorted (key, id) pairs of one model, where every entry is listed under its
+    lowercased label and its slug. A completion is a bisect to the first key
+    with the prefix and a walk while the keys still start with it, so it costs
+    O(log n + matches) whatever the number of entries."""
+    def __init__(self, entries=()):
+        self.labels = {}  # id -> (label, slug)
+        for entry_id, label, slug in entries:
+            self.labels[entry_id] = self._entry(label, slug)
+        # Sorted once, inserting tens of thousands of entries one by one is quadratic
+        self.keys = sorted((key, entry_id) for entry_id, entry in self.labels.items() for key in self._keys(*entry))
+
+    @staticmethod
+    def _entry(label, slug):
+        label = label or ''
+        return label, slug or slugify(label)
+
+    @staticmethod
+    def _keys(label, slug):
+        return {key for key in (label.casefold(), slug) if key}
+
+    def add(self, entry_id, label, slug):
+        self.remove(entry_id)
+        self.labels[entry_id] = self._entry(label, slug)
+        for key in self._keys(*self.labels[entry_id]):
+            insort(self.keys, (key, entry_id))
+
+    def remove(self, entry_id):
+        old = self.labels.pop(entry_id, None)
+        if old is None:
+            return
+        for key in self._keys(*old):
+            position = bisect_left(self.keys, (key, entry_id))
+            if position < len(self.keys) and self.keys[position] == (key, entry_id):
+                del self.keys[position]
+
+    def complete(self, prefix, limit):
+        found = []
+        seen = set()
+        position = bisect_left(self.keys, (prefix,))
+        while position < len(self.keys) and len(found) < limit:
+            key, entry_id = self.keys[position]
+            if not key.startswith(prefix):
+                break
+            if entry_id not in seen:
+                seen.add(entry_id)
+                label, slug = self.labels[entry_id]
+                found.append({'id': entry_id, 'label': label, 'slug': slug})
+            position += 1
+        return found
+
+
+_indexes = {}
+_indexes_lock = Lock()
+
+
+def _load_index(model_class):
+    label = get_label_column(model_class)
+    slug = model_class.slug if hasattr(model_class, 'slug') else literal(None)
+    return PrefixIndex(db.session.execute(select(model_class.id, label, slug)).all())
+
+
+def build_autocomplete(app):
+    """Loads the prefix index of every model with a label, one column only query
+    per model. Called at startup, later changes are applied as they commit."""
+    with app.app_context():
+        indexes = {
+            model_class: _load_index(model_class)
+            for model_class in MODELS.values()
+            if get_label_column(model_class) is not None
+        }
+    with _indexes_lock:
+        _indexes.clear()
+        _indexes.update(indexes)
+
+
+def autocomplete(model_class, query, limit=AUTOCOMPLETE_LIMIT):
+    """Returns up to `limit` {id, label, slug} of the entries whose label or slug
+    starts with `query` (case insensitive), in key order. Models without a label
+    (comments) have no index and complete nothing."""
+    prefix = query.strip().casefold()
+    if not prefix:
+        return []
+    with _indexes_lock:
+        index = _indexes.get(model_class)
+        return index.complete(prefix, limit) if index is not None else []
+
+#---------------------------Sync-------------------------------------
+# Changes are kept on the session while it flushes and only reach the index
+# once the transaction commits, so a rolled back insert or rename never shows
+# up in the completions. Other worker processes see changes after a restart.
+def _queue(target, label, slug):
+    session = OrmSession.object_session(target)
+    if session is not None:
+        session.info.setdefault('autocomplete', []).append((type(target), target.id, label, slug))
+
+def _entry_added(__mapper, __connection, target):
+    _queue(target, getattr(target, get_label_column(type(target)).key), getattr(target, 'slug', None))
+
+def _entry_changed(mapper, connection, target):
+    state = inspect(target)
+    label = get_label_column(type(target)).key
+    # Most updates (tokens, votes, levels) leave the label and slug alone
+    if any(state.attrs[column].history.has_changes() for column in (label, 'slug') if column in state.attrs):
+        _entry_added(mapper, connection, target)
+
+def _entry_deleted(__mapper, __connection, target):
+    _queue(target, None, None)
+
+def _apply_pending(session):
+    pending = session.info.pop('autocomplete', None)
+    if not pending:
+        return
+    with _indexes_lock:
+        for model_class, entry_id, label, slug in pending:
+            index = _indexes.get(model_class)
+            if index is None:
+                continue
+            if label is None and slug is None:
+                index.remove(entry_id)
+            else:
+                index.add(entry_id, label, slug)
+
+def _drop_pending(session, *args):
+    session.info.pop('autocomplete', None)
+
+for model_class in MODELS.values():
+    if get_label_column(model_class) is not None:
+        event.listen(model_class, 'after_insert', _entry_added)
+        event.listen(model_class, 'after_update', _entry_changed)
+        event.listen(model_class, 'after_delete', _entry_deleted)
+event.listen(OrmSession, 'after_commit', _apply_pending)
+event.listen(OrmSession, 'after_rollback', _drop_pending)
@@ -0,0 +1,53 @@
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session as OrmSession
+from .models import CacheVersion
+from . import db
+
+# Caches whose rows get created up front, see init_cache_versions
+PAGE_TREE = 'page_tree'
+GACHA_POOLS = 'gacha_pools'
+CACHE_NAMES = (PAGE_TREE, GACHA_POOLS)
+
+
+def init_cache_versions(app):
+    """Creates the version table on databases made before it existed and adds
+    the row of every cache, so a bump is a single UPDATE."""
+    with app.app_context():
+        CacheVersion.__table__.create(db.engine, checkfirst=True)
+        known = set(db.session.execute(select(CacheVersion.name)).scalars())
+        db.session.add_all(CacheVersion(name=name, version=0) for name in CACHE_NAMES if name not in known)
+        db.session.commit()
+
+
+def current_version(name):
+    """The committed version of a cache, as seen by this request. Read it before
+    loading the rows, so a copy is never newer than the version it is kept under."""
+    return db.session.execute(select(CacheVersion.version).where(CacheVersion.name == name)).scalar() or 0
+
+
+def mark_changed(target, name):
+    """Called from mapper events: the cache `name` gets bumped by this flush."""
+    session = OrmSession.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_caches', set()).add(name)
+
+#---------------------------Bumps-------------------------------------
+# The bump goes through the flush's transaction, so it commits or rolls back
+# with the change itself and no worker sees one without the other.
+def _bump_versions(session, __flush_context):
+    names = session.info.pop('changed_caches', None)
+    if not names:
+        return
+    connection = session.connection()
+    for name in sorted(names):
+        bumped = connection.execute(
+            update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+        )
+        if bumped.rowcount == 0:
+            connection.execute(insert(CacheVersion).values(name=name, version=1))
+
+def _drop_marks(session):
+    session.info.pop('changed_caches', None)
+
+event.listen(OrmSession, 'after_flush', _bump_versions)
+event.listen(OrmSession, 'after_rollback', _drop_marks)
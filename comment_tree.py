@@ -0,0 +1,85 @@
+from collections import namedtuple
+from sqlalchemy import select, func, literal, tuple_
+from .models import Comment, User
+from . import db
+
+COMMENTS_PAGE_SIZE = 20
+# Replies nested deeper than this are left out and the thread is continued on
+# its own view (?thread=<id>), which starts counting from that comment again
+MAX_COMMENT_DEPTH = 6
+
+CommentAuthor = namedtuple('CommentAuthor', ['id', 'name'])
+
+
+class CommentNode:
+    """Detached comment with its replies linked up, as rendered by render_comment."""
+    __slots__ = ('id', 'parent_id', 'user', 'comment_text', 'created_at', 'replies', 'more_replies')
+
+    def __init__(self, id, parent_id, user, comment_text, created_at):
+        self.id = id
+        self.parent_id = parent_id
+        self.user = user
+        self.comment_text = comment_text
+        self.created_at = created_at
+        self.replies = []
+        # Replies that are deeper than MAX_COMMENT_DEPTH and were not loaded
+        self.more_replies = 0
+
+
+def load_comment_threads(page_id, cursor=None, limit=COMMENTS_PAGE_SIZE, thread_id=None):
+    """Loads up to `limit` top-level comments of the page that come after `cursor`
+    ((created_at, id) of the last thread shown), or just the thread starting at
+    `thread_id`, together with their replies and authors in one recursive query.
+    Returns (root nodes, next cursor or None)."""
+    comment = Comment.__table__
+    if thread_id is not None:
+        roots = (
+            select(comment.c.id, literal(1).label('rank'))
+            .where(comment.c.id == thread_id, comment.c.page_id == page_id)
+        )
+        limit = 1
+    else:
+        roots = (
+            select(comment.c.id, func.row_number().over(order_by=(comment.c.created_at, comment.c.id)).label('rank'))
+            .where(comment.c.page_id == page_id, comment.c.parent_id.is_(None))
+        )
+        if cursor:
+            roots = roots.where(tuple_(comment.c.created_at, comment.c.id) > tuple_(*cursor))
+        # One extra root tells whether there is a next page, its replies are not followed
+        roots = roots.order_by(comment.c.created_at, comment.c.id).limit(limit + 1)
+    roots = roots.subquery()
+
+    chain = select(roots.c.id, roots.c.rank, literal(0).label('depth')).cte('comment_thread', recursive=True)
+    chain = chain.union_all(
+        select(comment.c.id, chain.c.rank, chain.c.depth + 1)
+        .where(comment.c.parent_id == chain.c.id, chain.c.rank <= limit, chain.c.depth <= MAX_COMMENT_DEPTH)
+    )
+    rows = db.session.execute(
+        select(comment.c.id, comment.c.parent_id, comment.c.comment_text, comment.c.created_at,
+               chain.c.rank, chain.c.depth, User.id.label('user_id'), User.name.label('user_name'))
+        .join(chain, comment.c.id == chain.c.id)
+        .outerjoin(User, User.id == comment.c.user_id)
+        .order_by(chain.c.rank, comment.c.created_at, comment.c.id)
+    ).all()
+
+    nodes = {}
+    for row in rows:
+        if row.rank <= limit and row.depth <= MAX_COMMENT_DEPTH:
+            user = CommentAuthor(row.user_id, row.user_name) if row.user_id is not None else None
+            nodes[row.id] = CommentNode(row.id, row.parent_id, user, row.comment_text, row.created_at)
+
+    roots = []
+    more = False
+    # Rows come sorted by creation time, so every replies list ends up sorted as well
+    for row in rows:
+        if row.rank > limit:
+            more = True
+        elif row.depth > MAX_COMMENT_DEPTH:
+            # Only fetched to know the thread goes on
+            nodes[row.parent_id].more_replies += 1
+        elif row.depth == 0:
+            roots.append(nodes[row.id])
+        else:
+            nodes[row.parent_id].replies.append(nodes[row.id])
+    next_cursor = (roots[-1].created_at, roots[-1].id) if more and roots else None
+    return roots, next_cursor
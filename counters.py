@@ -0,0 +1,38 @@
+from sqlalchemy import update, case, func
+from . import db
+
+# Counters (tokens, votes...) are only ever changed with a single UPDATE that does
+# the arithmetic in SQL, so concurrent requests cannot overwrite each other the way
+# a Python-side `user.tokens -= n` followed by a commit does. None of these commit,
+# the caller decides what else belongs in the same transaction.
+
+
+def _row(column, row_id):
+    model = column.class_
+    return update(model).where(model.id == row_id)
+
+
+def spend(column, row_id, cost, *returning):
+    """Takes `cost` from `column` of the row with id `row_id`, only if it holds at
+    least that much. Returns the row of the new value (and any `returning` columns),
+    or None when the row does not exist or cannot afford it."""
+    return db.session.execute(
+        _row(column, row_id)
+        .where(column >= cost)
+        .values({column: column - cost})
+        .returning(column, *returning)
+    ).first()
+
+
+def add(column, row_id, amount, floor=None):
+    """Adds `amount` (which may be negative) to `column` of the row with id
+    `row_id`, treating NULL as 0 and never going below `floor` when given.
+    Returns the new value, or None when the row does not exist."""
+    value = func.coalesce(column, 0) + amount
+    if floor is not None:
+        value = case((value < floor, floor), else_=value)
+    return db.session.execute(
+        _row(column, row_id)
+        .values({column: value})
+        .returning(column)
+    ).scalar()
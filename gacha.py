@@ -0,0 +1,123 @@
+from sqlalchemy import event
+from sqlalchemy.inspection import inspect
+from bisect import bisect
+from collections import namedtuple
+from itertools import accumulate
+from threading import Lock
+from flask import flash
+from .models import Item, Rarity
+from .cache_versions import current_version, mark_changed, GACHA_POOLS
+from . import db
+import random
+
+BASE_RATES = {
+    Rarity.legendary: 0.002,   # 0.2% - extremely rare, and without pity
+    Rarity.epic: 0.018,        # 1,8% - still rare, no pity
+    Rarity.rare: 0.02,         # 2% - balanced with 60-pull guarantee
+    Rarity.uncommon: 0.06,     # 6% - plenty of filler pulls
+    Rarity.common: 0.90        # 90% - rounds totals to 100%
+}
+PITY_THRESHOLD = 60        # pulls without a rare before one is guaranteed
+SMALL_PITY_THRESHOLD = 10  # pulls without an uncommon before one is guaranteed
+PULL_COST = 1              # tokens per pull
+# Item columns copied into the pools, changing any of them invalidates the pools
+POOL_COLUMNS = ('name', 'rarity', 'image', 'description', 'pullable')
+
+PoolItem = namedtuple('PoolItem', ['id', 'name', 'rarity', 'image', 'description'])
+
+
+class PityState:
+    """Pity counters detached from the User row, so a multi-pull can advance them
+    in memory and write them back with a single UPDATE."""
+    __slots__ = ('pity', 'small_pity')
+
+    def __init__(self, pity=0, small_pity=0):
+        self.pity = pity
+        self.small_pity = small_pity
+
+
+class GachaEngine:
+    """Keeps the pullable items bucketed by rarity and rolls against precomputed
+    cumulative weights, so a pull costs O(1) instead of rebuilding lists per pull."""
+
+    def __init__(self, rates):
+        self.rarities = list(rates.keys())
+        self.cum_weights = list(accumulate(rates.values()))
+        self.total = self.cum_weights[-1]
+        self._pools = None
+        self._version = None
+        self._lock = Lock()
+
+    def roll_rarity(self, rng=random):
+        return self.rarities[bisect(self.cum_weights, rng.random() * self.total)]
+
+    def get_pools(self):
+        """Returns rarity -> tuple of PoolItem, loaded with one query and cached until an
+        item changes, in this worker or any other."""
+        version = current_version(GACHA_POOLS)
+        with self._lock:
+            if self._pools is None or self._version != version:
+                buckets = {rarity: [] for rarity in Rarity}
+                rows = db.session.query(Item.id, Item.name, Item.rarity, Item.image, Item.description) \
+                                 .filter(Item.pullable == True).all()
+                for row in rows:
+                    buckets[row.rarity].append(PoolItem(*row))
+                self._pools = {rarity: tuple(items) for rarity, items in buckets.items()}
+                self._version = version
+            return self._pools
+
+    def invalidate(self):
+        with self._lock:
+            self._pools = None
+
+    def pull(self, user, pools, pity_threshold=PITY_THRESHOLD, small_pity_threshold=SMALL_PITY_THRESHOLD, rng=random):
+        """Rolls one item for the user and advances their pity counters."""
+        if not user.pity:
+            user.pity=0
+        if not user.small_pity:
+            user.small_pity=0
+        # Pity
+        if user.pity + 1 >= pity_threshold:
+            rarity = Rarity.rare
+        elif user.small_pity + 1 >= small_pity_threshold:
+            rarity = Rarity.uncommon
+        else:
+            rarity = self.roll_rarity(rng)
+
+        pool = pools[rarity]
+
+        if rarity==Rarity.epic or rarity==Rarity.legendary:
+            user.pity = 0
+            user.small_pity = 0
+        elif rarity == Rarity.rare:
+            user.pity = 0
+            user.small_pity = 0
+        elif rarity == Rarity.uncommon:
+            user.small_pity = 0
+        else:
+            user.pity += 1
+            user.small_pity += 1
+        if not pool:
+            flash(message="no items in category", category="error")
+            return None
+        # Choose random item from the pool
+        return rng.choice(pool)
+
+
+gacha = GachaEngine(BASE_RATES)
+
+#---------------------------Invalidation-------------------------------------
+# Same as the page tree: the flush marks the session, the pools' row in
+# cache_version is bumped in the same transaction, and every worker reloads
+# its pools once it sees the committed version change.
+def _item_changed(__mapper, __connection, target):
+    mark_changed(target, GACHA_POOLS)
+
+def _item_updated(__mapper, __connection, target):
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes() for key in POOL_COLUMNS):
+        mark_changed(target, GACHA_POOLS)
+
+event.listen(Item, 'after_insert', _item_changed)
+event.listen(Item, 'after_update', _item_updated)
+event.listen(Item, 'after_delete', _item_changed)
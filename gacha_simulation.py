@@ -0,0 +1,200 @@
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from flask import json
+from .gacha import BASE_RATES, PITY_THRESHOLD, SMALL_PITY_THRESHOLD, PULL_COST
+from .models import Rarity
+import click
+
+try:
+    import numpy as np
+except ImportError:  # only the offline simulation needs numpy, the site runs without it
+    np = None
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The pull simulation needs numpy, install it with `pip install numpy`")
+
+
+def simulate_chunk(users, pulls_per_user, rates, pity_threshold, small_pity_threshold, seed):
+    """Runs `pulls_per_user` pulls for `users` fresh virtual users at once, with
+    the same pity rules as GachaEngine.pull. Each step advances every user by one
+    pull, so the per-user pity state machine stays sequential while the work per
+    step is a handful of numpy operations over all users.
+
+    `rates` is a sequence of (rarity value, weight) pairs. Returns raw counters
+    that add up across chunks, see merge_counters."""
+    _require_numpy()
+    rng = np.random.default_rng(seed)
+    codes = np.array([code for code, _ in rates], dtype=np.int8)
+    cum_weights = np.cumsum([weight for _, weight in rates])
+    total = cum_weights[-1]
+    rare, uncommon, common = int(Rarity.rare), int(Rarity.uncommon), int(Rarity.common)
+
+    pity = np.zeros(users, dtype=np.int32)
+    small_pity = np.zeros(users, dtype=np.int32)
+    since_rare = np.zeros(users, dtype=np.int32)
+    rarity_counts = np.zeros(len(Rarity) + 1, dtype=np.int64)
+    # Pulls needed per rare-or-better. Uncommons do not advance the pity, so a
+    # streak can run past the threshold, up to every pull of the run
+    streaks = np.zeros(pulls_per_user + 1, dtype=np.int64)
+    hard_pity = small_pity_hits = 0
+
+    for _ in range(pulls_per_user):
+        rolled = codes[np.searchsorted(cum_weights, rng.random(users) * total, side='right')]
+        forced_rare = pity + 1 >= pity_threshold
+        forced_uncommon = ~forced_rare & (small_pity + 1 >= small_pity_threshold)
+        rarity = np.where(forced_rare, rare, np.where(forced_uncommon, uncommon, rolled))
+        hard_pity += int(np.count_nonzero(forced_rare))
+        small_pity_hits += int(np.count_nonzero(forced_uncommon))
+
+        is_common = rarity == common
+        hit = rarity >= rare
+        pity = np.where(hit, 0, pity + is_common)
+        small_pity = np.where(is_common, small_pity + 1, 0)
+
+        since_rare += 1
+        streaks += np.bincount(since_rare[hit], minlength=len(streaks))
+        since_rare[hit] = 0
+        rarity_counts += np.bincount(rarity, minlength=len(rarity_counts))
+
+    return {
+        'users': users,
+        'pulls': users * pulls_per_user,
+        'rarity_counts': rarity_counts.tolist(),
+        'streaks': streaks.tolist(),
+        'hard_pity': hard_pity,
+        'small_pity': small_pity_hits,
+    }
+
+
+def merge_counters(chunks):
+    merged = {'users': 0, 'pulls': 0, 'hard_pity': 0, 'small_pity': 0}
+    for chunk in chunks:
+        for key in merged:
+            merged[key] += chunk[key]
+    merged['rarity_counts'] = [sum(column) for column in zip(*(chunk['rarity_counts'] for chunk in chunks))]
+    merged['streaks'] = [sum(column) for column in zip(*(chunk['streaks'] for chunk in chunks))]
+    return merged
+
+
+def _percentile(histogram, fraction):
+    target = fraction * sum(histogram)
+    seen = 0
+    for value, count in enumerate(histogram):
+        seen += count
+        if count and seen >= target:
+            return value
+    return None
+
+
+def build_report(counters, rates, pulls_per_user, pity_threshold, small_pity_threshold, pull_cost):
+    pulls = counters['pulls']
+    total_weight = sum(rates.values())
+    rarity_counts = counters['rarity_counts']
+    streaks = counters['streaks']
+    rares = sum(streaks)
+    spent = pulls * pull_cost
+
+    distribution = {}
+    for rarity, weight in rates.items():
+        count = rarity_counts[int(rarity)]
+        distribution[rarity.name] = {
+            'base_rate': weight / total_weight,
+            'observed': count / pulls if pulls else 0,
+            'count': count,
+            'tokens_per_item': spent / count if count else None,
+        }
+
+    mean = sum(value * count for value, count in enumerate(streaks)) / rares if rares else None
+    return {
+        'users': counters['users'],
+        'pulls_per_user': pulls_per_user,
+        'pulls': pulls,
+        'pity_threshold': pity_threshold,
+        'small_pity_threshold': small_pity_threshold,
+        'distribution': distribution,
+        # Only completed streaks count, the pulls after a user's last rare are left out
+        'pulls_to_rare': {
+            'mean': mean,
+            'median': _percentile(streaks, 0.5),
+            'p90': _percentile(streaks, 0.9),
+            'max': max((value for value, count in enumerate(streaks) if count), default=None),
+            'streaks': rares,
+        },
+        'pity': {
+            'hard': counters['hard_pity'],
+            'small': counters['small_pity'],
+            'hard_share_of_rares': counters['hard_pity'] / rares if rares else None,
+        },
+        'tokens': {
+            'spent': spent,
+            'per_user': pulls_per_user * pull_cost,
+            'per_rare_or_better': mean * pull_cost if mean is not None else None,
+        },
+    }
+
+
+def simulate_pulls(users, pulls_per_user, rates=BASE_RATES, pity_threshold=PITY_THRESHOLD,
+                   small_pity_threshold=SMALL_PITY_THRESHOLD, pull_cost=PULL_COST, seed=None, workers=1):
+    """Simulates `pulls_per_user` pulls for each of `users` new players and returns
+    the observed rarity distribution, pulls-to-rare statistics, pity triggers and
+    token costs. With workers > 1 the users are sharded across a process pool,
+    every shard getting its own independent random stream."""
+    _require_numpy()
+    workers = max(1, min(workers, users))
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    rate_pairs = [(int(rarity), weight) for rarity, weight in rates.items()]
+    shards = [users // workers + (1 if i < users % workers else 0) for i in range(workers)]
+    args = [(shard, pulls_per_user, rate_pairs, pity_threshold, small_pity_threshold, shard_seed)
+            for shard, shard_seed in zip(shards, seeds)]
+
+    if workers == 1:
+        chunks = [simulate_chunk(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(simulate_chunk, *zip(*args)))
+
+    return build_report(merge_counters(chunks), rates, pulls_per_user,
+                        pity_threshold, small_pity_threshold, pull_cost)
+
+#---------------------------CLI-------------------------------------
+def _format(value, pattern):
+    return '-' if value is None else pattern.format(value)
+
+
+@click.command('simulate-pulls')
+@click.option('--pulls', default=10_000_000, show_default=True, help='Total pulls to simulate.')
+@click.option('--users', default=10_000, show_default=True, help='Virtual users the pulls are spread over.')
+@click.option('--pity', 'pity_threshold', default=PITY_THRESHOLD, show_default=True)
+@click.option('--small-pity', 'small_pity_threshold', default=SMALL_PITY_THRESHOLD, show_default=True)
+@click.option('--seed', type=int, default=None)
+@click.option('--workers', default=1, show_default=True, help='Processes to shard the users across.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the raw report as JSON.')
+def simulate_command(pulls, users, pity_threshold, small_pity_threshold, seed, workers, as_json):
+    """Simulate pulls offline with the current rates and pity rules."""
+    pulls_per_user = -(-pulls // users)
+    started = perf_counter()
+    report = simulate_pulls(users, pulls_per_user, pity_threshold=pity_threshold,
+                            small_pity_threshold=small_pity_threshold, seed=seed, workers=workers)
+    elapsed = perf_counter() - started
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    click.echo(f"{report['pulls']:,} pulls, {report['users']:,} users x {pulls_per_user:,}, "
+               f"pity {pity_threshold}/{small_pity_threshold}, {elapsed:.2f}s")
+    click.echo(f"{'rarity':<10} {'base':>8} {'observed':>9} {'count':>12} {'tokens/item':>12}")
+    for name, row in report['distribution'].items():
+        click.echo(f"{name:<10} {row['base_rate']:>8.3%} {row['observed']:>9.3%} {row['count']:>12,} "
+                   f"{_format(row['tokens_per_item'], '{:.1f}'):>12}")
+    to_rare = report['pulls_to_rare']
+    click.echo(f"pulls to rare+: mean {_format(to_rare['mean'], '{:.2f}')}, median {_format(to_rare['median'], '{}')}, "
+               f"p90 {_format(to_rare['p90'], '{}')}, max {_format(to_rare['max'], '{}')}")
+    pity = report['pity']
+    click.echo(f"pity triggers: hard {pity['hard']:,} ({_format(pity['hard_share_of_rares'], '{:.1%}')} of rares+), "
+               f"small {pity['small']:,}")
+    tokens = report['tokens']
+    click.echo(f"tokens: {tokens['spent']:,} spent, {tokens['per_user']:,} per user, "
+               f"{_format(tokens['per_rare_or_better'], '{:.2f}')} per rare+")
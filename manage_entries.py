@@ -1,9 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from sqlalchemy.inspection import inspect
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import Integer, Text, Boolean, Float, DateTime, Enum, func, Date, DateTime
-from .models import MODELS, Rarity
+from sqlalchemy import Integer, Text, Boolean, Float, DateTime, Enum, func, Date, DateTime, select, literal, union_all
+from sqlalchemy.orm import with_parent
+from .models import MODELS, get_by_slug
 from . import db
 from datetime import datetime
 from .page_editor import markdown_to_html, slugify
@@ -13,6 +14,20 @@ import json
 
 manage_entries = Blueprint('manage_entries', __name__)
 excluded_fields=['id', 'created_at', 'updated_at', 'password', 'comments', 'children', 'pity', 'small_pity', 'slug', 'is_admin', 'vote_count']
+# Tooltips only need the plain columns, and page bodies are too big to embed
+tooltip_excluded_fields = excluded_fields + ['content', 'content_md']
+MAX_BATCH_REFS = 500
+# Attributes tried, in order, to label related entries without loading them
+LABEL_COLUMNS = ['name', 'title']
+
+CHOICES_PAGE_SIZE = 50
+MAX_CHOICES_PAGE_SIZE = 200
+ENTRIES_PAGE_SIZE = 100
+MAX_ENTRIES_PAGE_SIZE = 1000
+ENTRIES_STREAM_BATCH = 1000
+
+_serializer_plans = {}
+_model_schemas = {}
 
 @manage_entries.route('/manage-entry', methods=['GET'])
 @login_required
@@ -20,7 +35,19 @@ def create_entry_page():
     return render_template('manage_entry.html', user=current_user, models=MODELS)
 
 
+def get_model_key(model_class):
+    """Returns the MODELS key of a model class, or None."""
+    return next((key for key, cls in MODELS.items() if cls is model_class), None)
+
+
+def get_label_column(model_class):
+    """Returns the column str() of an entry is based on, or None."""
+    return next((getattr(model_class, attr) for attr in LABEL_COLUMNS if hasattr(model_class, attr)), None)
+
+
 def extract_model_fields(model_class):
+    """Describes the editable fields of a model. Foreign keys and relationships only name the
+    model their choices come from, the choices themselves are paged in from /get-choices."""
     mapper = inspect(model_class)
     fields = []
 
@@ -46,9 +73,7 @@ def extract_model_fields(model_class):
 
             field['ref_table'] = ref_table
             field['ref_model'] = ref_model.__name__ if ref_model else None
-
-            if ref_model:
-                field['choices'] = [{'id': item.id, 'label': str(item)} for item in ref_model.query.all()]
+            field['choices_model'] = get_model_key(ref_model)
 
         else:
             field['type'] = (
@@ -74,11 +99,30 @@ def extract_model_fields(model_class):
             'type': 'relationship',
             'relationship_type': 'many' if rel.uselist else 'one',
             'ref_model': related_model.__name__,
-            'choices': [{'id': item.id, 'label': str(item)} for item in related_model.query.all()]
+            'choices_model': get_model_key(related_model),
         }
         fields.append(field)
 
     return fields
+
+
+def get_model_schema(model_class):
+    """Returns the cached field descriptors of a model."""
+    schema = _model_schemas.get(model_class)
+    if schema is None:
+        schema = extract_model_fields(model_class)
+        _model_schemas[model_class] = schema
+    return schema
+
+
+@manage_entries.record_once
+def build_model_schemas(state):
+    # The schema only depends on the models, so work it out once when the app starts
+    for model_class in MODELS.values():
+        get_model_schema(model_class)
+        get_serializer_plan(model_class)
+
+
 def extract_entry_values(model_instance):
     mapper = inspect(model_instance.__class__)
     fields = []
@@ -102,18 +146,89 @@ def get_fields(model_name):
     if not model:
         return jsonify({'error': 'Invalid model'}), 400
 
-    return jsonify(extract_model_fields(model))
+    return jsonify(get_model_schema(model))
+
+
+def build_label_query(model):
+    """Column-only (id, label) query of a model, filtered by the request's optional
+    `ids`, `q` (substring) and `prefix` arguments and ordered by id.
+    Raises ValueError for malformed ids."""
+    label = get_label_column(model)
+    query = db.session.query(model.id, label if label is not None else model.id)
+
+    ids = request.args.get('ids')
+    if ids:
+        query = query.filter(model.id.in_([int(i) for i in ids.split(',')]))
+    if label is not None:
+        q = request.args.get('q', '').strip()
+        if q:
+            query = query.filter(label.ilike(f'%{escape_like(q)}%', escape='\\'))
+        prefix = request.args.get('prefix', '').strip()
+        if prefix:
+            query = query.filter(label.ilike(f'{escape_like(prefix)}%', escape='\\'))
+    return query.order_by(model.id)
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def fetch_label_page(query, model, default_size, max_size):
+    """Returns one keyset page of a label query, continuing after the request's `after` id,
+    and the id to continue from (None on the last page)."""
+    limit = max(1, min(request.args.get('limit', default_size, type=int), max_size))
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.filter(model.id > after)
+
+    rows = query.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return [{'id': row[0], 'label': str(row[1])} for row in rows], (rows[-1][0] if more else None)
+
+
+@manage_entries.route('/get-choices/<model_name>')
+@login_required
+def get_choices(model_name):
+    """Pages through the (id, label) pairs of a model for the editor dropdowns.
+    Takes an optional search term `q`, the `after` id of the previous page, and `ids` to fetch specific entries."""
+    model = MODELS.get(model_name.lower())
+    if not model:
+        return jsonify({'error': 'Invalid model'}), 400
+
+    try:
+        query = build_label_query(model)
+    except ValueError:
+        return jsonify({'error': "'ids' must be a comma separated list of IDs"}), 400
+
+    choices, next_id = fetch_label_page(query, model, CHOICES_PAGE_SIZE, MAX_CHOICES_PAGE_SIZE)
+    return jsonify({'choices': choices, 'next': next_id})
 
 
 @manage_entries.route('/get-entries/<model_name>')
 @login_required
 def get_entries(model_name):
+    """Keyset paginated listing of a model's entries, with the same filters as /get-choices.
+    ?stream=1 streams every matching entry as one JSON array instead."""
     model = MODELS.get(model_name.lower())
     if not model:
         return jsonify({'error': 'Invalid model'}), 400
 
-    entries = model.query.all()
-    return jsonify([{'id': e.id, 'label': str(e)} for e in entries])
+    try:
+        query = build_label_query(model)
+    except ValueError:
+        return jsonify({'error': "'ids' must be a comma separated list of IDs"}), 400
+
+    if request.args.get('stream'):
+        def generate():
+            yield '['
+            for i, row in enumerate(query.yield_per(ENTRIES_STREAM_BATCH)):
+                yield (',' if i else '') + json.dumps({'id': row[0], 'label': str(row[1])})
+            yield ']'
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
+    entries, next_id = fetch_label_page(query, model, ENTRIES_PAGE_SIZE, MAX_ENTRIES_PAGE_SIZE)
+    return jsonify({'entries': entries, 'next': next_id})
 
 
 @manage_entries.route('/get-entry/<model_name>/<int:entry_id>')
@@ -124,33 +239,132 @@ def get_entry(model_name, entry_id):
         return jsonify({'error': 'Invalid model'}), 400
 
     entry = model.query.get_or_404(entry_id)
+    return jsonify(serialize_entry(entry, get_requested_fields()))
+
+def get_name_column(model):
+    """Returns the column entries are looked up by in the [/model/name] links, or None."""
     mapper = inspect(model)
+    columns = {col.name: col for col in mapper.columns}
+    if 'slug' in columns:
+        return columns['slug']
+    elif hasattr(model, "name"):
+        return getattr(model, "name")
+    elif hasattr(model, "title"):
+        return getattr(model, "title")
+    return None
+
+
+def get_serializer_plan(model):
+    """Works out once per model which columns and relationships get serialized, and how."""
+    plan = _serializer_plans.get(model)
+    if plan is None:
+        mapper = inspect(model)
+        columns = [(col.name, hasattr(col.type, 'enum_class')) for col in mapper.columns]
+        relationships = []
+        for rel in mapper.relationships:
+            if rel.key == "pulls":  # skip this relationship
+                continue
+            relationships.append((rel.key, rel.uselist, get_label_column(rel.mapper.class_)))
+        plan = {'columns': columns, 'relationships': relationships}
+        _serializer_plans[model] = plan
+    return plan
+
+
+def get_requested_fields():
+    """Reads the optional ?fields=a,b,c projection."""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return {field.strip() for field in fields.split(',') if field.strip()}
+
+
+def serialize_entry(entry, fields=None, skip=excluded_fields, with_relationships=True):
+    """Serializes an entry following its model's plan, limited to `fields` if given.
+    All labelled relationships are fetched together in a single UNION query."""
+    model = entry.__class__
+    plan = get_serializer_plan(model)
     data = {}
 
-    for col in mapper.columns:
-        if col.name in excluded_fields:
+    for name, is_enum in plan['columns']:
+        if name in skip or (fields is not None and name not in fields):
             continue
-        
-        value = getattr(entry, col.name)
-    
+
+        value = getattr(entry, name)
+
         # If the column is an Enum, return the name instead of the raw value
-        if hasattr(col.type, 'enum_class') and value is not None:
+        if is_enum and value is not None:
             value = value.name  # This will be "common", "uncommon", "rare", etc.
-    
-        data[col.name] = value
 
-    for rel in mapper.relationships:
-        if rel.key == "pulls":  # skip this relationship
+        data[name] = value
+
+    if not with_relationships:
+        return data
+
+    relationships = [rel for rel in plan['relationships'] if fields is None or rel[0] in fields]
+    labelled = [rel for rel in relationships if rel[2] is not None]
+    related = {key: [] for key, _, _ in relationships}
+    if labelled:
+        queries = [
+            select(literal(key).label('key'), label.class_.id.label('id'), label.label('name'))
+            .where(with_parent(entry, getattr(model, key)))
+            for key, _, label in labelled
+        ]
+        for row in db.session.execute(union_all(*queries)):
+            related[row.key].append({"id": row.id, "name": row.name})
+
+    for key, uselist, label in relationships:
+        if label is None:  # nothing to label it with in SQL, load the objects
+            value = getattr(entry, key)
+            values = list(value) if uselist else ([value] if value is not None else [])
+            related[key] = [{"id": r.id, "name": str(r)} for r in values]
+
+        if uselist:  # list of related objects
+            data[key] = related[key]
+        else:  # single related object
+            data[key] = related[key][0] if related[key] else None
+    return data
+
+
+def resolve_entries_by_name(refs):
+    """Resolves (model, name) pairs with one query per model.
+    Returns {model: {slug: tooltip data}}, names that don't resolve are left out."""
+    wanted = {}
+    for model_name, name in refs:
+        model_name = model_name.lower()
+        if model_name in MODELS:
+            wanted.setdefault(model_name, set()).add(slugify(name))
+
+    resolved = {}
+    for model_name, slugs in wanted.items():
+        model = MODELS[model_name]
+        column = get_name_column(model)
+        if column is None:
             continue
-        value = getattr(entry, rel.key)
+        if column.key == 'slug':
+            entries = model.query.filter(column.in_(slugs)).all()
+        else:
+            entries = model.query.filter(func.lower(column).in_(slugs)).all()
+        resolved[model_name] = {
+            getattr(entry, column.key).lower(): serialize_entry(entry, skip=tooltip_excluded_fields, with_relationships=False)
+            for entry in entries
+        }
+    return resolved
+
+
+@manage_entries.route('/get-entries-by-name', methods=['POST'])
+@login_required
+def get_entries_by_name():
+    data = request.get_json(silent=True) or {}
+    refs = data.get('refs')
+    if not isinstance(refs, list) or len(refs) > MAX_BATCH_REFS:
+        return jsonify({"error": f"'refs' must be a list of at most {MAX_BATCH_REFS} [model, name] pairs"}), 400
+    try:
+        refs = [(str(model_name), str(name)) for model_name, name in refs]
+    except (TypeError, ValueError):
+        return jsonify({"error": "Every ref must be a [model, name] pair"}), 400
+
+    return jsonify(resolve_entries_by_name(refs))
 
-        if rel.uselist:  # list of related objects
-            data[rel.key] = [
-                {"id": r.id, "name": str(r)} for r in value
-            ]
-        else:  # single related object
-            data[rel.key] = {"id": value.id, "name": str(value)} if value else None
-    return jsonify(data)
 
 @manage_entries.route('/get-entry-by-name/<model_name>/<path:name>')
 @login_required
@@ -159,51 +373,21 @@ def get_entry_by_name(model_name, name):
     if not model:
         return jsonify({"error": "Invalid model"}), 400
 
-    mapper = inspect(model)
-    columns = {col.name: col for col in mapper.columns}
-
-    if 'slug' in columns:
-        column = columns['slug']
-        search_value = slugify(name)
-    elif hasattr(model, "name"):
-        column = getattr(model, "name")
-        search_value = slugify(name)
-    elif hasattr(model, "title"):
-        column = getattr(model, "title")
-        search_value = slugify(name)
-    else:
+    column = get_name_column(model)
+    if column is None:
         return jsonify({"error": "No searchable field"}), 400
+    search_value = slugify(name)
 
-    entry = model.query.filter(func.lower(column) == search_value).first()
+    # Slugs are stored lowercase already, only the name/title fallback needs lower()
+    if column.key == 'slug':
+        entry = get_by_slug(model, search_value)
+    else:
+        entry = model.query.filter(func.lower(column) == search_value).first()
 
     if not entry:
         return jsonify({"error": "Not found"}), 404
 
-    data = {}
-
-    for col in mapper.columns:
-        if col.name in excluded_fields:
-            continue
-        
-        value = getattr(entry, col.name)
-    
-        # If the column is an Enum, return the name instead of the raw value
-        if hasattr(col.type, 'enum_class') and value is not None:
-            value = value.name  # This will be "common", "uncommon", "rare", etc.
-    
-        data[col.name] = value
-    for rel in mapper.relationships:
-        if rel.key == "pulls":  # skip this relationship
-            continue
-        value = getattr(entry, rel.key)
-
-        if rel.uselist:  # list of related objects
-            data[rel.key] = [
-                {"id": r.id, "name": str(r)} for r in value
-            ]
-        else:  # single related object
-            data[rel.key] = {"id": value.id, "name": str(value)} if value else None
-    return jsonify(data)
+    return jsonify(serialize_entry(entry, get_requested_fields()))
 
 @manage_entries.route('/submit-page', methods=['POST'])
 @login_required
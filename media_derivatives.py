@@ -0,0 +1,201 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session as OrmSession
+from threading import Lock
+from flask import current_app, url_for
+from .models import MediaFile
+from .media_store import file_digest
+from . import db
+import logging
+import uuid
+import os
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow no derivatives are made and the originals are served as before
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Widths of the WebP copies made for every uploaded image, the smallest one doubles as thumbnail
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+WEBP_QUALITY = 80
+DERIVATIVE_WORKERS = 2
+# Derivatives live in the media folder under their source's sha256, so the same
+# image uploaded twice is only converted once and a URL never changes content
+DERIVATIVE_DIR = '.derivatives'
+# Gifs are left alone since resizing would drop their animation
+RESIZABLE_MIMES = {'image/png', 'image/jpeg', 'image/webp'}
+DEFAULT_SIZES = '(max-width: 700px) 100vw, 700px'
+
+_executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix='media-derivatives')
+_pending_lock = Lock()
+_pending = set()
+_srcset_lock = Lock()
+_srcset_cache = {'files': None, 'version': 0}
+
+
+def derivative_name(digest, width):
+    return f'{digest}-{width}.webp'
+
+
+def derivative_path(upload_folder, name):
+    return os.path.join(upload_folder, DERIVATIVE_DIR, name[:2], name)
+
+
+def generate_derivatives(upload_folder, filename, digest=None):
+    """Writes the WebP derivatives of one image (only widths below its own, images
+    are never scaled up) and returns (digest, widths). Derivatives that already
+    exist for the same content are kept as they are."""
+    path = os.path.join(upload_folder, filename)
+    digest = digest or file_digest(path)
+    with Image.open(path) as image:
+        widths = [width for width in DERIVATIVE_WIDTHS if width < image.width]
+        if not widths:
+            return digest, widths
+        mode = 'RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB'
+        source = image.convert(mode)
+        for width in widths:
+            target = derivative_path(upload_folder, derivative_name(digest, width))
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            height = max(1, round(image.height * width / image.width))
+            temp = f'{target}.{uuid.uuid4().hex}.tmp'
+            source.resize((width, height), Image.LANCZOS).save(temp, 'WEBP', quality=WEBP_QUALITY)
+            os.replace(temp, target)
+    return digest, widths
+
+
+def _process(app, filename):
+    with _pending_lock:
+        _pending.discard(filename)
+    with app.app_context():
+        media = MediaFile.query.filter_by(filename=filename).first()
+        if media is None or media.mime not in RESIZABLE_MIMES:
+            return
+        try:
+            media.digest, widths = generate_derivatives(app.config['UPLOAD_FOLDER'], filename, media.digest)
+            media.derivatives = ','.join(str(width) for width in widths)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.exception('Could not make derivatives of %s', filename)
+            # Marked as done, so a broken image is not retried on every reconcile
+            media.derivatives = ''
+        try:
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception('Could not record derivatives of %s', filename)
+
+
+def queue_derivatives(filename):
+    """Makes the derivatives of an indexed image on the worker pool. Returns the
+    Future, or None when Pillow is not installed or the file is already queued."""
+    if Image is None:
+        return None
+    with _pending_lock:
+        if filename in _pending:
+            return None
+        _pending.add(filename)
+    return _executor.submit(_process, current_app._get_current_object(), filename)
+
+
+def queue_missing_derivatives():
+    """Queues every indexed image whose derivatives were never made, e.g. files
+    copied into the media folder or indexed before Pillow was installed."""
+    if Image is None:
+        return 0
+    rows = db.session.query(MediaFile.filename) \
+                     .filter(MediaFile.derivatives.is_(None), MediaFile.mime.in_(RESIZABLE_MIMES)).all()
+    for row in rows:
+        queue_derivatives(row.filename)
+    return len(rows)
+
+
+def discard_derivatives(upload_folder, digests):
+    """Removes the derivative files of the given digests that no indexed file
+    uses any more. Call it after the index rows are gone."""
+    digests = {digest for digest in digests if digest}
+    if not digests:
+        return
+    still_used = {row.digest for row in db.session.query(MediaFile.digest).filter(MediaFile.digest.in_(digests))}
+    for digest in digests - still_used:
+        for width in DERIVATIVE_WIDTHS:
+            path = derivative_path(upload_folder, derivative_name(digest, width))
+            if os.path.exists(path):
+                os.remove(path)
+
+#---------------------------srcset-------------------------------------
+def _load_derivatives():
+    """filename -> (digest, width, derivative widths) of every image with
+    derivatives, loaded with one query and cached until the index changes."""
+    with _srcset_lock:
+        if _srcset_cache['files'] is None:
+            rows = db.session.query(MediaFile.filename, MediaFile.digest, MediaFile.width, MediaFile.derivatives) \
+                             .filter(MediaFile.derivatives.isnot(None), MediaFile.derivatives != '').all()
+            _srcset_cache['files'] = {
+                row.filename: (row.digest, row.width, tuple(int(width) for width in row.derivatives.split(',')))
+                for row in rows
+            }
+        return _srcset_cache['files']
+
+
+def derivatives_version():
+    """Changes whenever the available derivatives do, for caches of rendered html."""
+    return _srcset_cache['version']
+
+
+def media_srcset(filename):
+    """Returns the srcset of an image (its derivatives plus the original), or None
+    when it has no derivatives yet."""
+    entry = _load_derivatives().get(filename)
+    if entry is None:
+        return None
+    digest, width, widths = entry
+    candidates = [f"{url_for('upload.media_derivative', name=derivative_name(digest, w))} {w}w" for w in widths]
+    candidates.append(f"{url_for('upload.media_file', filename=filename)} {width}w")
+    return ', '.join(candidates)
+
+
+def media_thumbnail(filename):
+    """Returns the URL of the smallest derivative of an image, or of the file itself."""
+    entry = _load_derivatives().get(filename)
+    if entry is None:
+        return url_for('upload.media_file', filename=filename)
+    digest, _, widths = entry
+    return url_for('upload.media_derivative', name=derivative_name(digest, widths[0]))
+
+
+def invalidate_derivatives():
+    with _srcset_lock:
+        _srcset_cache['files'] = None
+        _srcset_cache['version'] += 1
+
+#---------------------------Invalidation-------------------------------------
+# As for the page tree, a flush only marks the session and the map is dropped
+# once the transaction commits. Dropped at flush time, a request in between
+# could rebuild it from the old rows and cache html without the new srcset
+# under the new version.
+def mark_derivatives_changed(session):
+    """Drops the srcset map when `session` commits. For bulk Query.update() and
+    .delete() on MediaFile, which fire no mapper events."""
+    session.info['derivatives_changed'] = True
+
+def _media_changed(__mapper, __connection, target):
+    session = OrmSession.object_session(target)
+    if session is not None:
+        mark_derivatives_changed(session)
+
+def _derivatives_committed(session):
+    if session.info.pop('derivatives_changed', False):
+        invalidate_derivatives()
+
+def _derivatives_rolled_back(session):
+    session.info.pop('derivatives_changed', None)
+
+event.listen(MediaFile, 'after_insert', _media_changed)
+event.listen(MediaFile, 'after_update', _media_changed)
+event.listen(MediaFile, 'after_delete', _media_changed)
+event.listen(OrmSession, 'after_commit', _derivatives_committed)
+event.listen(OrmSession, 'after_rollback', _derivatives_rolled_back)
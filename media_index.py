@@ -0,0 +1,230 @@
+from sqlalchemy import tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from threading import Thread, Event
+from datetime import datetime
+from .models import MediaFile
+from .media_derivatives import queue_missing_derivatives, discard_derivatives, mark_derivatives_changed
+from .media_store import adopt_unstored, release_blob
+from . import db
+import mimetypes
+import logging
+import struct
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+MEDIA_PAGE_SIZE = 60
+MAX_MEDIA_PAGE_SIZE = 200
+# Seconds between background rescans of the media folder, 0 turns them off
+RECONCILE_INTERVAL = 300
+# Uploads in progress sit in the media folder under this prefix, they are not
+# indexed and are cleaned up once nothing was written to them for a day
+UPLOAD_TEMP_PREFIX = '.upload-'
+STALE_UPLOAD_AGE = 24 * 3600
+# Sortable columns and how to read their value back from a cursor
+MEDIA_SORTS = {
+    'name': (MediaFile.filename, str),
+    'mtime': (MediaFile.mtime, datetime.fromisoformat),
+    'size': (MediaFile.size, int),
+}
+
+#---------------------------Metadata-------------------------------------
+def _png_size(f, head):
+    if head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+
+def _gif_size(f, head):
+    return struct.unpack('<HH', head[6:10])
+
+def _webp_size(f, head):
+    chunk = head[12:16]
+    if chunk == b'VP8X':
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L':
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+
+def _jpeg_size(f, head):
+    # Walk the segments (skipping their payload) until a start-of-frame marker
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', _png_size),
+    (b'GIF8', _gif_size),
+    (b'\xff\xd8', _jpeg_size),
+    (b'RIFF', _webp_size),
+)
+
+def image_dimensions(path):
+    """Returns (width, height) read from the image header, or None for anything
+    that is not a png, gif, jpeg or webp image. Only the header is read."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+            for signature, reader in IMAGE_SIGNATURES:
+                if head.startswith(signature):
+                    if reader is _webp_size and head[8:12] != b'WEBP':
+                        return None
+                    return reader(f, head)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def describe_file(path, stat=None):
+    """Returns the MediaFile column values for the file at `path`."""
+    stat = stat or os.stat(path)
+    mime = mimetypes.guess_type(path)[0]
+    size = image_dimensions(path) if mime and mime.startswith('image/') else None
+    return {
+        'size': stat.st_size,
+        'mtime': datetime.utcfromtimestamp(stat.st_mtime),
+        'mime': mime,
+        'width': size[0] if size else None,
+        'height': size[1] if size else None,
+        # Changed content needs new derivatives
+        'digest': None,
+        'derivatives': None,
+    }
+
+#---------------------------Index upkeep-------------------------------------
+def index_file(upload_folder, filename, digest=None):
+    """Adds or refreshes the index row of a file that was just written, with the
+    digest it is stored under. The caller commits."""
+    values = describe_file(os.path.join(upload_folder, filename))
+    values['digest'] = digest
+    media = MediaFile.query.filter_by(filename=filename).first()
+    if media is None:
+        media = MediaFile(filename=filename)
+        db.session.add(media)
+    for key, value in values.items():
+        setattr(media, key, value)
+    return media
+
+
+def unindex_file(filename):
+    """Drops the index row of a deleted file. The caller commits."""
+    MediaFile.query.filter_by(filename=filename).delete()
+    # A bulk delete fires no mapper events, the srcset cache would keep the file
+    mark_derivatives_changed(db.session)
+
+
+def reconcile_media(upload_folder):
+    """Brings the index in line with the media folder: one os.scandir, one query
+    for the indexed (size, mtime) pairs, and only new or changed files get
+    opened. Catches files copied in or removed behind the app's back, and
+    removes abandoned uploads and the blobs and derivatives no name uses any
+    more. Returns (added, updated, removed) counts."""
+    indexed = {
+        row.filename: row
+        for row in db.session.query(MediaFile.id, MediaFile.filename, MediaFile.size, MediaFile.mtime, MediaFile.digest)
+    }
+    dropped_digests = set()
+    added = updated = 0
+    seen = set()
+    now = time.time()
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.startswith('.'):
+                if entry.name.startswith(UPLOAD_TEMP_PREFIX) and now - stat.st_mtime > STALE_UPLOAD_AGE:
+                    os.remove(entry.path)
+                continue
+            seen.add(entry.name)
+            row = indexed.get(entry.name)
+            mtime = datetime.utcfromtimestamp(stat.st_mtime)
+            if row is not None and row.size == stat.st_size and row.mtime == mtime:
+                continue
+            values = describe_file(entry.path, stat)
+            if row is None:
+                db.session.add(MediaFile(filename=entry.name, **values))
+                added += 1
+            else:
+                db.session.query(MediaFile).filter_by(id=row.id).update(values)
+                dropped_digests.add(row.digest)
+                updated += 1
+    removed = [row for name, row in indexed.items() if name not in seen]
+    if removed:
+        db.session.query(MediaFile).filter(MediaFile.id.in_([row.id for row in removed])).delete()
+        dropped_digests.update(row.digest for row in removed)
+    if updated or removed:
+        # The bulk update/delete above fire no mapper events
+        mark_derivatives_changed(db.session)
+    db.session.commit()
+    for digest in dropped_digests:
+        release_blob(upload_folder, digest)
+    discard_derivatives(upload_folder, dropped_digests)
+    return added, updated, len(removed)
+
+
+def start_media_reconciler(app):
+    """Reconciles the index right away and then every MEDIA_RECONCILE_INTERVAL
+    seconds (app config, RECONCILE_INTERVAL by default) on a daemon thread, moves
+    new files into the blob store and queues the images still missing derivatives. Returns the Event that stops it."""
+    interval = app.config.get('MEDIA_RECONCILE_INTERVAL', RECONCILE_INTERVAL)
+    stop = Event()
+
+    def run():
+        while not stop.is_set():
+            with app.app_context():
+                try:
+                    if os.path.isdir(app.config['UPLOAD_FOLDER']):
+                        reconcile_media(app.config['UPLOAD_FOLDER'])
+                        adopt_unstored(app.config['UPLOAD_FOLDER'])
+                        queue_missing_derivatives()
+                except (OSError, SQLAlchemyError):
+                    db.session.rollback()
+                    logger.exception('Media index reconciliation failed')
+            if not interval:
+                return
+            stop.wait(interval)
+
+    Thread(target=run, name='media-reconciler', daemon=True).start()
+    return stop
+
+#---------------------------Queries-------------------------------------
+def query_media(sort='mtime', descending=True, cursor=None, limit=MEDIA_PAGE_SIZE, kind=None):
+    """Returns (MediaFile rows, next cursor) for one page of the index, sorted by
+    one of MEDIA_SORTS and paged by keyset on (sort column, id). `kind` keeps
+    only one MIME type family, e.g. 'image' or 'video'."""
+    column, parse = MEDIA_SORTS[sort]
+    query = MediaFile.query
+    if kind:
+        query = query.filter(MediaFile.mime.like(f'{kind}/%'))
+    if cursor:
+        value, cursor_id = cursor.rsplit('_', 1)
+        position = tuple_(parse(value), int(cursor_id))
+        keyset = tuple_(column, MediaFile.id)
+        query = query.filter(keyset < position if descending else keyset > position)
+    if descending:
+        query = query.order_by(column.desc(), MediaFile.id.desc())
+    else:
+        query = query.order_by(column.asc(), MediaFile.id.asc())
+    rows = query.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not more:
+        return rows, None
+    last = rows[-1]
+    value = getattr(last, column.key)
+    value = value.isoformat() if isinstance(value, datetime) else value
+    return rows, f'{value}_{last.id}'
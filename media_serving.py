@@ -0,0 +1,82 @@
+from flask import current_app, request, abort
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from urllib.parse import quote
+from datetime import datetime
+from .models import MediaFile
+from . import db
+import mimetypes
+import os
+
+# Originals keep their name when replaced (delete and upload again), so browsers
+# reuse them for an hour and revalidate with the ETag after that
+MEDIA_MAX_AGE = 3600
+# Derivative URLs carry the content hash, their bytes never change
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# MEDIA_OFFLOAD app config: None streams the file from Python, 'x-sendfile' hands the
+# path to the front server (Apache mod_xsendfile, lighttpd), 'x-accel-redirect' hands
+# MEDIA_ACCEL_PREFIX + the path inside the media folder to an nginx internal location:
+#     location /protected-media/ { internal; alias /srv/website/static/media/; }
+OFFLOAD_MODES = (None, 'x-sendfile', 'x-accel-redirect')
+ACCEL_PREFIX = '/protected-media/'
+
+
+def media_etag(filename, path):
+    """Returns the content hash of an indexed file as its ETag, so the tag survives
+    touches and copies, or None (the size/mtime based default) while the index
+    has no hash or the file changed since it was hashed."""
+    media = db.session.query(MediaFile.digest, MediaFile.size, MediaFile.mtime) \
+                      .filter_by(filename=filename).first()
+    if media is None or media.digest is None:
+        return None
+    stat = os.stat(path)
+    if media.size != stat.st_size or media.mtime != datetime.utcfromtimestamp(stat.st_mtime):
+        return None
+    return media.digest
+
+
+def _accel_redirect(path, upload_folder, etag, max_age):
+    """The headers-only response nginx serves `path` for. Conditional requests are
+    still answered here, ranges are left to nginx."""
+    stat = os.stat(path)
+    internal = os.path.relpath(path, upload_folder).replace(os.sep, '/')
+    prefix = current_app.config.get('MEDIA_ACCEL_PREFIX', ACCEL_PREFIX)
+    rv = current_app.response_class(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    rv.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(internal)
+    rv.last_modified = stat.st_mtime
+    rv.set_etag(etag or f'{stat.st_mtime}-{stat.st_size}')
+    rv.cache_control.max_age = max_age
+    rv = rv.make_conditional(request)
+    if rv.status_code == 304:
+        rv.headers.pop('X-Accel-Redirect', None)
+    return rv
+
+
+def send_media(upload_folder, relative_path, etag=None, immutable=False):
+    """Sends a file from the media folder with a strong ETag, Last-Modified, 304s,
+    byte ranges and private cache headers (long-lived and immutable for content
+    addressed files), or hands it to the front server in MEDIA_OFFLOAD mode."""
+    path = safe_join(upload_folder, relative_path)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    max_age = IMMUTABLE_MAX_AGE if immutable else current_app.config.get('MEDIA_MAX_AGE', MEDIA_MAX_AGE)
+    mode = current_app.config.get('MEDIA_OFFLOAD')
+    if mode not in OFFLOAD_MODES:
+        raise ValueError(f'MEDIA_OFFLOAD must be one of {OFFLOAD_MODES}')
+
+    if mode == 'x-accel-redirect':
+        rv = _accel_redirect(path, upload_folder, etag, max_age)
+    else:
+        rv = send_file(
+            path, request.environ,
+            etag=etag or True,
+            max_age=max_age,
+            use_x_sendfile=mode == 'x-sendfile',
+            response_class=current_app.response_class,
+        )
+    # Media sits behind the login, shared caches must not keep it
+    rv.cache_control.public = None
+    rv.cache_control.private = True
+    if immutable:
+        rv.cache_control.immutable = True
+    return rv
@@ -0,0 +1,164 @@
+from sqlalchemy import select, literal, func, union_all
+from .models import MediaFile, User, Page, Spell, Monster, Session, Quest, NPC, PlayerCharacter, Pathway, Sequence, Item, FanContent
+from . import db
+from datetime import datetime
+import hashlib
+import shutil
+import os
+
+# Every stored file is kept once under its sha256 in BLOB_DIR, and each of its
+# names in the media folder is a hard link to that blob. The names stay plain
+# files, so /media/<name>, the index and everything referring to a name work
+# as before, while a duplicate upload only adds a link. Files must not be edited
+# in place, that would change every name sharing the content.
+BLOB_DIR = '.blobs'
+DIGEST_BUFFER = 1024 * 1024
+# Columns that refer to a media file by name
+MEDIA_REFERENCES = (
+    User.image, Page.image, Spell.image, Monster.image, Session.image, Quest.image,
+    NPC.image, PlayerCharacter.image, Pathway.image, Sequence.image, Item.image,
+    FanContent.file_path,
+)
+
+
+class HashingFile:
+    """Wraps a file opened for writing and hashes everything written to it, so an
+    upload is hashed while it streams in instead of being read back."""
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DIGEST_BUFFER), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_path(upload_folder, digest):
+    return os.path.join(upload_folder, BLOB_DIR, digest[:2], digest)
+
+
+def has_blob(upload_folder, digest):
+    return os.path.isfile(blob_path(upload_folder, digest))
+
+
+def _link_name(blob, file_path):
+    """Makes `file_path` a name of the blob without replacing an existing file.
+    Returns False if the name is taken."""
+    try:
+        os.link(blob, file_path)
+    except FileExistsError:
+        return False
+    except OSError:
+        # Filesystems without hard links get a copy
+        try:
+            with open(blob, 'rb') as src, open(file_path, 'xb') as dst:
+                shutil.copyfileobj(src, dst)
+        except FileExistsError:
+            return False
+    return True
+
+
+def store_file(temp_path, upload_folder, filename, digest):
+    """Publishes a finished temp file under `filename`. The content goes to the
+    blob store unless a blob with the same digest is there already, in which case
+    the temp file is just dropped. Returns False if the name is taken by other
+    content, re-uploading the same content under its own name succeeds."""
+    blob = blob_path(upload_folder, digest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    # Never replaces a blob, two uploads of the same content racing here both
+    # end up linking their names to whichever blob was created first
+    created = _link_name(temp_path, blob)
+    os.remove(temp_path)
+    if link_blob(upload_folder, filename, digest):
+        return True
+    # Unless another upload linked a name to it in the meantime
+    if created and os.stat(blob).st_nlink == 1:
+        os.remove(blob)
+    return False
+
+
+def link_blob(upload_folder, filename, digest):
+    """Adds `filename` as a name of a stored blob. Returns False if the name is
+    taken by other content."""
+    blob = blob_path(upload_folder, digest)
+    file_path = os.path.join(upload_folder, filename)
+    if _link_name(blob, file_path):
+        return True
+    return os.path.samefile(blob, file_path)
+
+
+def adopt_file(upload_folder, filename):
+    """Moves a file that was copied into the media folder by hand into the blob
+    store, replacing it with a link when the content is stored already. Returns
+    its digest."""
+    file_path = os.path.join(upload_folder, filename)
+    digest = file_digest(file_path)
+    blob = blob_path(upload_folder, digest)
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        _link_name(file_path, blob)
+    elif not os.path.samefile(blob, file_path):
+        # Dot files are skipped by the index
+        temp = os.path.join(upload_folder, f'.adopt-{digest}.tmp')
+        if _link_name(blob, temp):
+            os.replace(temp, file_path)
+    return digest
+
+
+def adopt_unstored(upload_folder):
+    """Adopts every indexed file that is not in the blob store yet (copied in by
+    hand, or changed since it was stored) and records its digest. Returns the
+    number of files adopted."""
+    rows = MediaFile.query.filter(MediaFile.digest.is_(None)).all()
+    for media in rows:
+        media.digest = adopt_file(upload_folder, media.filename)
+        # A replaced file now has the blob's mtime
+        stat = os.stat(os.path.join(upload_folder, media.filename))
+        media.size = stat.st_size
+        media.mtime = datetime.utcfromtimestamp(stat.st_mtime)
+        db.session.commit()
+    return len(rows)
+
+
+def release_blob(upload_folder, digest):
+    """Removes the blob of a digest once no indexed name uses it. Call it after the
+    name's index row is gone. Returns True if the blob was removed."""
+    if not digest:
+        return False
+    if db.session.query(MediaFile.id).filter_by(digest=digest).first() is not None:
+        return False
+    blob = blob_path(upload_folder, digest)
+    if os.path.exists(blob):
+        os.remove(blob)
+    return True
+
+
+def media_references(filename):
+    """Returns {'Item.image': count, ...} for every column (and the page markdown)
+    that still refers to `filename`, in one query."""
+    counts = [
+        select(literal(f'{column.class_.__name__}.{column.key}').label('source'), func.count().label('uses'))
+        .where(column == filename)
+        for column in MEDIA_REFERENCES
+    ]
+    counts.append(
+        select(literal('Page.content_md').label('source'), func.count().label('uses'))
+        # Names are full of '_', a LIKE wildcard
+        .where(Page.content_md.contains(f']({filename})', autoescape=True))
+    )
+    rows = db.session.execute(union_all(*counts)).all()
+    return {row.source: row.uses for row in rows if row.uses}
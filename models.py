@@ -1,6 +1,6 @@
 from . import db
 from flask_login import UserMixin
-from sqlalchemy import func, event, Enum
+from sqlalchemy import func, event, Enum, select, literal
 from slugify import slugify
 from sqlalchemy.orm import backref
 from datetime import datetime
@@ -104,6 +104,8 @@ monster_spells = db.Table(
     )
 )
 
+MAX_PAGE_DEPTH = 1000
+
 class User(db.Model, UserMixin):
     __tablename__ = 'user'
     id = db.Column(db.Integer, primary_key=True)
@@ -147,29 +149,37 @@ class Page(db.Model):
         return self.title
 
     def get_ancestors(self):
-        """Returns a list of all parent pages up to the root."""
-        ancestors = []
-        current = self.parent
-        while current:
-            ancestors.insert(0, current)
-            current = current.parent
-        return ancestors
+        """Returns a list of all parent pages up to the root, resolved with a single recursive query."""
+        if self.parent_id is None:
+            return []
+        page = Page.__table__
+        chain = (
+            select(page.c.id, page.c.parent_id, literal(1).label('depth'))
+            .where(page.c.id == self.parent_id)
+            .cte('ancestors', recursive=True)
+        )
+        chain = chain.union_all(
+            select(page.c.id, page.c.parent_id, chain.c.depth + 1)
+            .where(page.c.id == chain.c.parent_id, chain.c.depth < MAX_PAGE_DEPTH)  # guards against parent cycles
+        )
+        return Page.query.join(chain, Page.id == chain.c.id).order_by(chain.c.depth.desc()).all()
 
     def get_path(self):
         """Returns the full path from root to this page."""
         return "/".join([ancestor.slug for ancestor in self.get_ancestors()] + [self.slug])
 
-    def get_tree(self):
-        """Recursively returns a dictionary representing the page and its children."""
-        return {
-            'id': self.id,
-            'title': self.title,
-            'slug': self.slug,
-            'children': [child.get_tree() for child in self.children.order_by(Page.title)]
-        }
+    def get_tree(self, depth=None):
+        """Returns a dictionary representing the page and its children, built from the cached page tree."""
+        from .page_tree import get_page_nodes, serialize_node
+        return serialize_node(get_page_nodes()[self.id], depth)
 
 class Comment(db.Model):
     __tablename__ = 'comment'
+    __table_args__ = (
+        # Threads are paged per page by creation time, then followed down by parent
+        db.Index('ix_comment_page_id_parent_id_created_at', 'page_id', 'parent_id', 'created_at'),
+        db.Index('ix_comment_parent_id', 'parent_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     page_id = db.Column(db.Integer, db.ForeignKey('page.id'), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('comment.id'), nullable=True)
@@ -227,6 +237,10 @@ class Monster(db.Model):
         return self.name
 
 class Session(db.Model):
+    __table_args__ = (
+        # The session browser pages through past sessions by date
+        db.Index('ix_session_session_date', 'session_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
     slug = db.Column(db.String(200), nullable=False, unique=True)
@@ -404,6 +418,10 @@ class Item(db.Model):
 
 class Pulls(db.Model):
     __tablename__ = 'pulls'
+    __table_args__ = (
+        # Pull history is always read per user, newest first
+        db.Index('ix_pulls_user_id_pull_time', 'user_id', 'pull_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     gatcha_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
@@ -415,6 +433,10 @@ class Pulls(db.Model):
         return f"<PullLog user_id={self.user_id} item_id={self.gatcha_id} pull_time={self.pull_time}>"
 
 class FanContent(db.Model):
+    __table_args__ = (
+        # Session winners rank the content of each session by votes
+        db.Index('ix_fan_content_session_id_vote_count', 'session_id', 'vote_count'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('session.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -426,6 +448,37 @@ class FanContent(db.Model):
     def __str__(self):
         return self.title
 
+class MediaFile(db.Model):
+    """Index of the files in the media folder, so listing them needs no directory scan."""
+    __tablename__ = 'media_file'
+    __table_args__ = (
+        # The media browser sorts by any of these
+        db.Index('ix_media_file_mtime', 'mtime'),
+        db.Index('ix_media_file_size', 'size'),
+        db.Index('ix_media_file_digest', 'digest'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    mtime = db.Column(db.DateTime, nullable=False)
+    mime = db.Column(db.String(100), nullable=True)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    # sha256 of the content and the widths of its WebP derivatives ("320,640"),
+    # NULL until the derivative workers got to the file, '' when it has none
+    digest = db.Column(db.String(64), nullable=True)
+    derivatives = db.Column(db.String(100), nullable=True)
+    def __str__(self):
+        return self.filename
+
+class CacheVersion(db.Model):
+    """One row per in-memory cache (page tree, gacha pools), bumped in the same
+    transaction as the change to the cached rows. Every worker process compares
+    it with the version its copy was built from, one primary key lookup."""
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 #---------------------------Slugs-------------------------------------
 # Single source of truth for model name mapping
 MODELS = {
@@ -459,8 +512,44 @@ def generate_slug(__mapper, __connection, target):
         value = getattr(target, source_attr)
         if value:
             # Only update slug if empty or if the source attribute changed (optional)
-            target.slug = slugify(value)
+            new_slug = slugify(value)
+            forget_slugs(type(target), target.slug, new_slug)
+            target.slug = new_slug
+
+def drop_slug(__mapper, __connection, target):
+    if hasattr(target, 'slug'):
+        forget_slugs(type(target), target.slug)
+
 # Attach listeners for insert and update for all models you want
 for model_class in MODELS.values():
     event.listen(model_class, 'before_insert', generate_slug)
-    event.listen(model_class, 'before_update', generate_slug)
\ No newline at end of file
+    event.listen(model_class, 'before_update', generate_slug)
+    event.listen(model_class, 'after_delete', drop_slug)
+
+#---------------------------Slug lookup cache---------------------------------
+# Process wide slug -> id map per model class. Slugs are already lowercase, so
+# lookups go straight through the unique slug index, and repeated ones (tooltips)
+# become primary key gets that the session can answer from its identity map.
+slug_cache = {}
+
+def forget_slugs(model_class, *slugs):
+    ids = slug_cache.get(model_class)
+    if ids:
+        for slug in slugs:
+            ids.pop(slug, None)
+
+def get_by_slug(model_class, slug):
+    """Returns the entry with the given slug, or None."""
+    ids = slug_cache.setdefault(model_class, {})
+    entry_id = ids.get(slug)
+    if entry_id is not None:
+        entry = db.session.get(model_class, entry_id)
+        # Another worker may have renamed it since, so double check before trusting the cache
+        if entry is not None and entry.slug == slug:
+            return entry
+        ids.pop(slug, None)
+
+    entry = model_class.query.filter(model_class.slug == slug).first()
+    if entry is not None:
+        ids[slug] = entry.id
+    return entry
\ No newline at end of file
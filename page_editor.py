@@ -1,8 +1,16 @@
 from flask import Blueprint, render_template
 from flask_login import login_required, current_user
 from .models import Page
+from .media_derivatives import media_srcset, derivatives_version, DEFAULT_SIZES
+from collections import OrderedDict
+from threading import Lock, local
+from markdown.extensions import Extension
+from markdown.inlinepatterns import InlineProcessor
+from markdown.util import AtomicString
+import xml.etree.ElementTree as etree
 import markdown
 import bleach
+import hashlib
 import re
 from slugify import slugify
 
@@ -18,6 +26,31 @@ STYLE_MAP = {
     'underline': 'text-decoration: underline',
     # colors will be handled separately
 }
+MARKDOWN_EXTENSIONS = [
+    "extra",          # Tables, fenced code blocks, etc.
+    "abbr",           # Abbreviations
+    "attr_list",      # Attribute lists
+    "def_list",       # Definition lists
+    "fenced_code",    # Triple backtick code blocks
+    "footnotes",      # Footnotes support
+    "tables",         # Tables support
+    "toc",            # Table of contents
+]
+RENDER_CACHE_SIZE = 256
+
+# Custom wiki syntax, matched by the inline processors of WikiMarkupExtension.
+# Every repetition is bounded and can't run over the next delimiter, so a failed
+# match only ever rescans a few hundred characters, whatever the input looks like.
+CUSTOM_LINK_PATTERN = r'\[/(\w{1,50})/([\w \t-]{1,200})\]'
+STYLING_PATTERN = r'\{([^{}\n]{1,500})\}:[ \t]*([\w \t,]{1,200})'
+LINK_TAG_PATTERN = re.compile(r'<a\b([^>]*)>')
+LINK_ATTR_PATTERN = re.compile(r'\bdata-(model|name)="([^"]*)"')
+IMAGE_PATTERN = r'!\[([^\[\]\n]{0,500})\]\(([^()\s]{1,500})\)(?::(\d{0,5}%?)x(\d{0,5}%?)(?:,[ \t]*(left|right|center))?)?'
+
+# Markdown instances are not thread safe, so every worker thread keeps its own and resets it between renders
+_markdown_local = local()
+_render_cache = OrderedDict()
+_render_cache_lock = Lock()
 
 @page_editor.route('/edit/', defaults={'slug': None})
 @page_editor.route('/edit/<slug>')
@@ -26,56 +59,64 @@ def edit_page(slug):
     page = None
     if slug:
         page = Page.query.filter_by(slug=slug).first_or_404()
-    pages = Page.query.all()
-    return render_template("page_editor.html", page=page, all_pages=pages, user=current_user)
+    # The parent is picked with /autocomplete/page, only the current one is rendered
+    return render_template("page_editor.html", page=page, user=current_user)
 
 
 
-def markdown_to_html(markdown_text):
-    extensions = [
-        "extra",          # Tables, fenced code blocks, etc.
-        "abbr",           # Abbreviations
-        "attr_list",      # Attribute lists
-        "def_list",       # Definition lists
-        "fenced_code",    # Triple backtick code blocks
-        "footnotes",      # Footnotes support
-        "tables",         # Tables support
-        "toc",            # Table of contents
-    ]
-    # Convert Markdown to HTML
-    text=expand_images(markdown_text)
-    html = markdown.markdown(
-        text,
-        extensions=extensions,
-        output_format="html5"
-    )
-    html = expand_styling(html)
+def get_markdown():
+    md = getattr(_markdown_local, 'md', None)
+    if md is None:
+        md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS + [WikiMarkupExtension()], output_format="html5")
+        _markdown_local.md = md
+    return md
+
+
+def render_markdown(markdown_text):
+    # Convert Markdown to HTML, the custom syntax is handled in the same pass
+    html = get_markdown().reset().convert(markdown_text)
     html_clean=html
     #html_clean=sanitize_html(html)
-    html_clean=expand_custom_links(html_clean)
     return html_clean
 
 
-def expand_custom_links(md_text):
-    pattern_no_text = re.compile(r'\[\/(\w+)\/([\w\s-]+)\]')
-    
-    def replacer_no_text(match):
-        model = match.group(1)
-        raw_name = match.group(2)
-        slug_name = slugify(raw_name)
-        display_text = raw_name.title()
-        return f'<a href="#" class="link" data-name="{slug_name}" data-model="{model}">{display_text}</a>'
-    
-    return pattern_no_text.sub(replacer_no_text, md_text)
-
-
-def expand_styling(text):
-    pattern = re.compile(r'\{([^}]+)\}:\s*([\w\s,]+)')
+def markdown_to_html(markdown_text):
+    """Renders the page markdown, reusing the cached html if the same content was rendered before
+    (and no image got new derivatives since)."""
+    key = (hashlib.sha256(markdown_text.encode('utf-8')).hexdigest(), derivatives_version())
+    with _render_cache_lock:
+        html = _render_cache.get(key)
+        if html is not None:
+            _render_cache.move_to_end(key)
+            return html
+
+    html = render_markdown(markdown_text)
+    with _render_cache_lock:
+        _render_cache[key] = html
+        if len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return html
+
+
+class CustomLinkProcessor(InlineProcessor):
+    """[/model/name] -> link picked up by the tooltips"""
+    def handleMatch(self, m, data):
+        model = m.group(1)
+        raw_name = m.group(2)
+        el = etree.Element('a')
+        el.set('href', '#')
+        el.set('class', 'link')
+        el.set('data-name', slugify(raw_name))
+        el.set('data-model', model)
+        el.text = AtomicString(raw_name.title())
+        return el, m.start(0), m.end(0)
+
+
+class StylingProcessor(InlineProcessor):
+    """{text}: bold, red -> styled span, the text itself is still parsed as markdown"""
+    def handleMatch(self, m, data):
+        styles = [s.strip().lower() for s in m.group(2).split(',')]
 
-    def replacer(match):
-        content = match.group(1)
-        styles = [s.strip().lower() for s in match.group(2).split(',')]
-        
         css_styles = []
         for style in styles:
             if style in STYLE_MAP:
@@ -83,11 +124,11 @@ def expand_styling(text):
             else:
                 # Assume any style not in map is a color name
                 css_styles.append(f'color: {style}')
-        
-        style_attr = '; '.join(css_styles)
-        return f'<span style="{style_attr}">{content}</span>'
-    
-    return pattern.sub(replacer, text)
+
+        el = etree.Element('span')
+        el.set('style', '; '.join(css_styles))
+        el.text = m.group(1)
+        return el, m.start(0), m.end(0)
 
 
 def add_unit(val):
@@ -95,15 +136,13 @@ def add_unit(val):
         return None
     return val if val.endswith('%') else val + 'px'
 
-def expand_images(md_text):
-    pattern = r'!\[(.*?)\]\((.*?)\)(?::(\d*%?)x(\d*%?)(?:,\s*(left|right|center))?)?'
-
-    def repl(match):
-        alt_text = match.group(1)
-        url = '/media/'+match.group(2)
-        width = match.group(3)
-        height = match.group(4)
-        align = match.group(5)
+class ImageProcessor(InlineProcessor):
+    """![alt](file):WxH, align -> sized image served from the media folder, with the
+    WebP derivatives of the file as srcset once they exist"""
+    def handleMatch(self, m, data):
+        width = m.group(3)
+        height = m.group(4)
+        align = m.group(5)
 
         styles = []
         w = add_unit(width)
@@ -119,15 +158,41 @@ def expand_images(md_text):
             elif align == 'center':
                 styles.append('display:block; margin-left:auto; margin-right:auto;')
 
-        style_str = ' '.join(styles)
-
-        if style_str:
-            return f'<img src="{url}" alt="{alt_text}" style="{style_str}"/>'
-        else:
-            return f'<img src="{url}" alt="{alt_text}"/>'
-
-    return re.sub(pattern, repl, md_text)
-
+        el = etree.Element('img')
+        el.set('src', '/media/' + m.group(2))
+        el.set('alt', m.group(1))
+        srcset = media_srcset(m.group(2))
+        if srcset:
+            el.set('srcset', srcset)
+            # A fixed pixel width is all the browser needs, anything else may fill the column
+            el.set('sizes', w if w and w.endswith('px') else DEFAULT_SIZES)
+        el.set('loading', 'lazy')
+        if styles:
+            el.set('style', ' '.join(styles))
+        return el, m.start(0), m.end(0)
+
+
+class WikiMarkupExtension(Extension):
+    """Registers the custom wiki syntax as inline patterns, so a page is tokenized once.
+    They rank below code spans and escapes (which stay literal) and above the regular links and images."""
+    def extendMarkdown(self, md):
+        md.inlinePatterns.register(ImageProcessor(IMAGE_PATTERN, md), 'wiki_image', 176)
+        md.inlinePatterns.register(CustomLinkProcessor(CUSTOM_LINK_PATTERN, md), 'wiki_link', 175)
+        md.inlinePatterns.register(StylingProcessor(STYLING_PATTERN, md), 'wiki_styling', 174)
+
+
+
+def extract_custom_links(html):
+    """Returns the unique (model, name) pairs of the entity links in a rendered page."""
+    refs = []
+    seen = set()
+    for tag in LINK_TAG_PATTERN.finditer(html or ''):
+        attrs = dict(LINK_ATTR_PATTERN.findall(tag.group(1)))
+        ref = (attrs.get('model'), attrs.get('name'))
+        if ref[0] and ref[1] and ref not in seen:
+            seen.add(ref)
+            refs.append(ref)
+    return refs
 
 
 def sanitize_html(html):
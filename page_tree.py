@@ -0,0 +1,153 @@
+from sqlalchemy import event
+from sqlalchemy.inspection import inspect
+from threading import Lock
+from .models import Page
+from .cache_versions import current_version, mark_changed, PAGE_TREE
+from . import db
+from collections import OrderedDict
+import hashlib
+import json
+
+# Columns that change the shape or labels of the tree, edits to anything else
+# (content, image...) leave the cached tree valid.
+TREE_COLUMNS = ('title', 'slug', 'parent_id')
+# Encoded (root, depth) variants kept, least recently used ones go first
+TREE_JSON_CACHE_SIZE = 256
+
+_tree_lock = Lock()
+_tree_cache = {'roots': None, 'nodes': None, 'height': 0, 'version': None, 'json': OrderedDict()}
+
+
+class PageNode:
+    """Lightweight, detached stand-in for a Page inside the cached tree."""
+    __slots__ = ('id', 'title', 'slug', 'parent_id', 'children')
+
+    def __init__(self, id, title, slug, parent_id):
+        self.id = id
+        self.title = title
+        self.slug = slug
+        self.parent_id = parent_id
+        self.children = []
+
+    def __repr__(self):
+        return self.title
+
+
+def build_page_tree():
+    """Loads every page in one query and links them up in memory.
+    Returns the root nodes (sorted by title) and an id -> node lookup."""
+    rows = db.session.query(Page.id, Page.title, Page.slug, Page.parent_id).order_by(Page.title).all()
+    nodes = {row.id: PageNode(row.id, row.title, row.slug, row.parent_id) for row in rows}
+    roots = []
+    # Rows come sorted by title, so every children list ends up sorted as well
+    for node in nodes.values():
+        if node.parent_id is None:
+            roots.append(node)
+        elif node.parent_id in nodes:
+            nodes[node.parent_id].children.append(node)
+    return roots, nodes
+
+
+def tree_height(roots):
+    """Number of levels below and including the roots."""
+    height = 0
+    level = roots
+    while level:
+        height += 1
+        level = [child for node in level for child in node.children]
+    return height
+
+
+def _load_tree():
+    # Another worker may have changed the pages since this copy was built
+    version = current_version(PAGE_TREE)
+    with _tree_lock:
+        if _tree_cache['roots'] is None or _tree_cache['version'] != version:
+            _tree_cache['roots'], _tree_cache['nodes'] = build_page_tree()
+            _tree_cache['height'] = tree_height(_tree_cache['roots'])
+            _tree_cache['version'] = version
+            _tree_cache['json'] = OrderedDict()
+        return _tree_cache['roots'], _tree_cache['nodes']
+
+
+def get_page_tree():
+    """Returns the cached root nodes of the wiki, building them on first use."""
+    return _load_tree()[0]
+
+
+def get_page_nodes():
+    """Returns the cached id -> PageNode lookup of the wiki."""
+    return _load_tree()[1]
+
+
+def serialize_node(node, depth=None):
+    """Returns the node as a dict, expanding at most `depth` levels of children
+    (all of them when depth is None). Unexpanded nodes keep `has_children` so
+    clients can fetch them later."""
+    data = {
+        'id': node.id,
+        'title': node.title,
+        'slug': node.slug,
+        'has_children': bool(node.children),
+    }
+    if depth is None or depth > 0:
+        next_depth = None if depth is None else depth - 1
+        data['children'] = [serialize_node(child, next_depth) for child in node.children]
+    return data
+
+
+def get_tree_json(root=None, depth=None):
+    """Returns (body, etag) for the whole tree or for the subtree under `root`,
+    or None if `root` does not exist. The encoded bytes are cached until the
+    tree is invalidated. A depth reaching past the deepest page expands the same
+    as no depth, so it shares that cache entry."""
+    roots, nodes = _load_tree()
+    if depth is not None and depth >= _tree_cache['height']:
+        depth = None
+    key = (root, depth)
+    with _tree_lock:
+        cached = _tree_cache['json'].get(key)
+        if cached is not None and _tree_cache['nodes'] is nodes:
+            _tree_cache['json'].move_to_end(key)
+            return cached
+
+    if root is None:
+        data = [serialize_node(node, depth) for node in roots]
+    elif root in nodes:
+        data = serialize_node(nodes[root], depth)
+    else:
+        return None
+
+    body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    with _tree_lock:
+        # Only keep it if the tree was not invalidated while serializing
+        if _tree_cache['nodes'] is nodes:
+            _tree_cache['json'][key] = (body, etag)
+            if len(_tree_cache['json']) > TREE_JSON_CACHE_SIZE:
+                _tree_cache['json'].popitem(last=False)
+    return body, etag
+
+
+def invalidate_page_tree():
+    with _tree_lock:
+        _tree_cache['roots'] = None
+        _tree_cache['nodes'] = None
+        _tree_cache['json'] = OrderedDict()
+
+#---------------------------Invalidation-------------------------------------
+# The listeners run at flush time and only mark the session. The tree's row in
+# cache_version is bumped in the same transaction, and every worker rebuilds
+# its copy once it sees the committed version change, never from rows that are
+# not committed yet (or get rolled back).
+def _page_changed(__mapper, __connection, target):
+    mark_changed(target, PAGE_TREE)
+
+def _page_updated(__mapper, __connection, target):
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes() for key in TREE_COLUMNS):
+        mark_changed(target, PAGE_TREE)
+
+event.listen(Page, 'after_insert', _page_changed)
+event.listen(Page, 'after_update', _page_updated)
+event.listen(Page, 'after_delete', _page_changed)
@@ -1,103 +1,102 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, flash, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy.inspection import inspect
-from .models import MODELS, Rarity, Pulls, User, Rarity, Item
-from . import db
+from .models import Pulls, User, Item
+from . import db, counters
+from .gacha import gacha, PityState, PULL_COST
+from .media_derivatives import media_srcset, media_thumbnail
+from sqlalchemy import tuple_, insert, update
 from datetime import datetime
-import random
 
 pull = Blueprint('pull', __name__)
 
-BASE_RATES = {
-    Rarity.legendary: 0.002,   # 0.2% - extremely rare, and without pity
-    Rarity.epic: 0.018,        # 1,8% - still rare, no pity
-    Rarity.rare: 0.02,         # 2% - balanced with 60-pull guarantee
-    Rarity.uncommon: 0.06,     # 6% - plenty of filler pulls
-    Rarity.common: 0.90        # 90% - rounds totals to 100%
-}
-
-def get_pulled_item(user, items, pity_threshold=90, small_pity_threshold=10):
-    
-    if not user.pity:
-        user.pity=0
-    if not user.small_pity:
-        user.small_pity=0
-    # Pity
-    if user.pity + 1 >= pity_threshold:
-        rarity = Rarity.rare
-    elif user.small_pity + 1 >= small_pity_threshold:
-        rarity = Rarity.uncommon
-    else:
-        rarity = random.choices(
-            population=list(BASE_RATES.keys()),
-            weights=list(BASE_RATES.values()),
-            k=1
-        )[0]
-
-    pool = [i for i in items if i.rarity == rarity]
-
-    if rarity==Rarity.epic or rarity==Rarity.legendary:
-        user.pity = 0
-        user.small_pity = 0
-    elif rarity == Rarity.rare:
-        user.pity = 0
-        user.small_pity = 0
-    elif rarity == Rarity.uncommon:
-        user.small_pity = 0
-    else:
-        user.pity += 1
-        user.small_pity += 1
-    if not pool:
-        flash(message="no items in category", category="error")
-        return None
-    # Choose random item from the pool
-    pulled_item = random.choice(pool)
-    return pulled_item
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+HISTORY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 @pull.route('/pull-page', methods=['GET','POST'])
 @login_required
 def pull_page():
-    logs = Pulls.query.filter_by(user_id=current_user.id).order_by(Pulls.pull_time.desc()).limit(20).all()
-    return render_template('pull.html', user=current_user, logs=logs)
+    # The history itself is paged in by handle_pull.js
+    return render_template('pull.html', user=current_user)
 
 @pull.route('/pull/<int:amount>', methods=['POST'])
 @login_required
 def pulling_js(amount=1):
-    if(current_user.tokens<=0):
+    if amount < 1:
+        return jsonify({'error': 'Nothing to pull'}), 400
+    cost = amount * PULL_COST
+    # Taking the tokens first also locks the user row, so concurrent pulls by the
+    # same user queue up behind this one instead of reusing the same pity.
+    charged = counters.spend(User.tokens, current_user.id, cost, User.pity, User.small_pity)
+    if charged is None:
+        db.session.rollback()
         flash(message="You dont have enough tokens, but nice try!")
-        return None
-    items = Item.query.filter_by(pullable=True).all()
-    pulled_items = []
-    
+        return jsonify({'error': 'Not enough tokens'}), 400
+
+    pools = gacha.get_pools()
+    state = PityState(charged.pity or 0, charged.small_pity or 0)
+    pulled = []
     for i in range(amount):
-        pulled_item = get_pulled_item(current_user, items, 60, 10)
+        pulled_item = gacha.pull(state, pools)
         if not pulled_item:
+            db.session.rollback()
             return jsonify({'error': 'No items available'}), 400
-        log = Pulls(user_id=current_user.id, gatcha_id=pulled_item.id)
-        db.session.add(log)
-        pulled_items.append({
-            'name': pulled_item.name,
-            'rarity': pulled_item.rarity.name.lower(),
-            'image': pulled_item.image,
-            'pulled_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-            'description': pulled_item.description
-        })
-    
-    current_user.tokens -= amount
+        pulled.append(pulled_item)
+
+    now = datetime.utcnow()
+    db.session.execute(insert(Pulls), [
+        {'user_id': current_user.id, 'gatcha_id': item.id, 'pull_time': now} for item in pulled
+    ])
+    db.session.execute(
+        update(User).where(User.id == current_user.id)
+        .values(pity=state.pity, small_pity=state.small_pity)
+    )
     db.session.commit()
-    
-    return jsonify({'pulled_items': pulled_items, 'tokens': current_user.tokens,'pity': current_user.pity,'smallPity':current_user.small_pity})
 
+    pulled_at = now.strftime(HISTORY_TIME_FORMAT)
+    pulled_items = [{
+        'name': item.name,
+        'rarity': item.rarity.name.lower(),
+        'image': item.image,
+        'srcset': media_srcset(item.image) if item.image else None,
+        'thumbnail': media_thumbnail(item.image) if item.image else None,
+        'pulled_at': pulled_at,
+        'description': item.description
+    } for item in pulled]
+    return jsonify({'pulled_items': pulled_items, 'tokens': charged.tokens,'pity': state.pity,'smallPity':state.small_pity})
+
+@pull.route('/pull-history', methods=['GET'])
 @pull.route('/pull-history/<int:no>', methods=['GET'])
 @login_required
-def pull_hystory(no=20):
-    logs = Pulls.query.filter_by(user_id=current_user.id).order_by(Pulls.pull_time.desc()).limit(no).all()
+def pull_hystory(no=None):
+    """One page of the user's pulls, newest first. `cursor` is the `next` value of the previous page."""
+    limit = no or request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    query = (
+        db.session.query(Pulls.id, Pulls.pull_time, Item.name, Item.rarity, Item.image)
+        .join(Item, Pulls.gatcha_id == Item.id)
+        .filter(Pulls.user_id == current_user.id)
+    )
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_time, cursor_id = cursor.rsplit('_', 1)
+            cursor_time = datetime.fromisoformat(cursor_time)
+            cursor_id = int(cursor_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(tuple_(Pulls.pull_time, Pulls.id) < tuple_(cursor_time, cursor_id))
+
+    logs = query.order_by(Pulls.pull_time.desc(), Pulls.id.desc()).limit(limit + 1).all()
+    more = len(logs) > limit
+    logs = logs[:limit]
     history=[]
     for log in logs:
         history.append({
-            'name': log.item.name,
-            'rarity': log.item.rarity.name.lower(),
-            'image': log.item.image,
-            'pulled_at': log.pull_time.strftime('%Y-%m-%d %H:%M:%S')
+            'name': log.name,
+            'rarity': log.rarity.name.lower(),
+            'image': log.image,
+            'pulled_at': log.pull_time.strftime(HISTORY_TIME_FORMAT)
         })
-    return jsonify(history)
+    next_cursor = f'{logs[-1].pull_time.isoformat()}_{logs[-1].id}' if more else None
+    return jsonify({'history': history, 'next': next_cursor})
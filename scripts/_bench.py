@@ -0,0 +1,76 @@
+"""Setup shared by the benchmark scripts: imports the repository as the
+`website` package and builds the app over a throwaway SQLite database."""
+import importlib.util
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from sqlalchemy import event
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_website():
+    if 'website' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('website', ROOT / '__init__.py',
+                                                      submodule_search_locations=[str(ROOT)])
+        website = importlib.util.module_from_spec(spec)
+        sys.modules['website'] = website
+        spec.loader.exec_module(website)
+    return sys.modules['website']
+
+
+def create_bench_app():
+    """Returns an app on an empty database in a temporary folder, with an admin
+    (bench@example.com / secret1) to log in with."""
+    website = load_website()
+    from werkzeug.security import generate_password_hash
+    from website.models import User
+
+    folder = Path(tempfile.mkdtemp(prefix='website-bench-'))
+    app = website.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{folder / 'bench.db'}",
+        'UPLOAD_FOLDER': str(folder / 'media'),
+        'MEDIA_RECONCILE_INTERVAL': 0,
+    })
+    with app.app_context():
+        website.db.session.add(User(email='bench@example.com', name='Bench', password=generate_password_hash('secret1'),
+                                    is_admin=True, tokens=1_000_000, votes_remaining=3))
+        website.db.session.commit()
+    return app
+
+
+def login(app):
+    client = app.test_client()
+    client.post('/login', data={'email': 'bench@example.com', 'password': 'secret1'})
+    return client
+
+
+def best_of(func, repeat=5):
+    """Best wall time of `repeat` calls, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return min(times) * 1000
+
+
+def count_queries(engine, func):
+    statements = []
+    record = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        func()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def report(name, ms, queries=None):
+    line = f'{name:32s}{ms:10.3f} ms'
+    if queries is not None:
+        line += f'  {queries} queries'
+    print(line)
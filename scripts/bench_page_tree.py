@@ -0,0 +1,50 @@
+"""Times the wiki page tree on 2,000 pages: building it, serving it from the
+cache, the /wiki page and the /api/pages/tree JSON.
+
+    python scripts/bench_page_tree.py [--pages 2000]
+"""
+import argparse
+import random
+
+from _bench import best_of, count_queries, create_bench_app, login, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    from website import db
+    from website.models import Page
+    from website.page_tree import get_page_tree, get_tree_json, invalidate_page_tree
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        ids = []
+        for i in range(args.pages):
+            # One page in 20 is a root, the others hang anywhere below
+            page = Page(title=f'Page {i}', parent_id=rng.choice(ids) if ids and i % 20 else None)
+            db.session.add(page)
+            db.session.flush()
+            ids.append(page.id)
+        db.session.commit()
+
+        cold = lambda: (invalidate_page_tree(), get_page_tree())
+        print(f'{args.pages} pages')
+        report('build tree', best_of(cold), count_queries(db.engine, cold))
+        report('cached tree', best_of(get_page_tree), count_queries(db.engine, get_page_tree))
+        report('cached json', best_of(get_tree_json))
+        engine = db.engine
+
+    # Outside the app context, so every request gets its own like in production
+    client = login(app)
+    for url in ('/wiki', '/api/pages/tree', '/api/pages/tree?depth=1'):
+        client.get(url)
+        get = lambda: client.get(url)
+        report(f'GET {url}', best_of(get), count_queries(engine, get))
+
+
+if __name__ == '__main__':
+    main()
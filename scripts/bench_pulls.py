@@ -0,0 +1,46 @@
+"""Times 10 and 1,000 pulls: the rolls alone against the cached pools, and the
+whole /pull/<amount> request with its queries.
+
+    python scripts/bench_pulls.py [--items 5000]
+"""
+import argparse
+
+from _bench import best_of, count_queries, create_bench_app, login, report
+
+PULL_COUNTS = (10, 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    from website import db
+    from website.gacha import gacha, PityState
+    from website.models import Item, Rarity
+
+    rarities = list(Rarity)
+    with app.app_context():
+        # One item in 7 stays out of the pools
+        db.session.add_all([Item(name=f'Item {i}', rarity=rarities[i % len(rarities)], pullable=i % 7 != 0)
+                            for i in range(args.items)])
+        db.session.commit()
+        pools = gacha.get_pools()
+        engine = db.engine
+
+    print(f'{args.items} items')
+    with app.test_request_context():
+        for amount in PULL_COUNTS:
+            state = PityState()
+            report(f'{amount} rolls', best_of(lambda: [gacha.pull(state, pools) for _ in range(amount)]))
+
+    client = login(app)
+    for amount in PULL_COUNTS:
+        post = lambda: client.post(f'/pull/{amount}')
+        post()
+        report(f'POST /pull/{amount}', best_of(post), count_queries(engine, post))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Renders per second of wiki pages: a fresh render, the first pass through the
+render cache and a warm cache, plus short pages.
+
+    python scripts/bench_render.py [--pages 20] [--paragraphs 200]
+"""
+import argparse
+import random
+from time import perf_counter
+
+from _bench import create_bench_app
+
+WORDS = ('the party goblin dragon tavern sword [/npc/old-mira] {Danger}: red, bold '
+         '![map](map.png):300x200, center **loot** *arcane* `code`').split(' ')
+SHORT_PAGE = '## Short\nSome *text* [/npc/bob] {x}: red'
+
+
+def session_notes(rng, paragraphs):
+    """A long page using the custom syntax next to tables, lists, footnotes and a TOC."""
+    lines = ['# Session notes', '[TOC]', '']
+    for i in range(paragraphs):
+        if i % 25 == 0:
+            lines.append(f'## Chapter {i}\n')
+        if i % 10 == 3:
+            lines.append('| Name | HP |\n|---|---|\n| Goblin | 7 |\n| Ogre | 59 |\n')
+        if i % 13 == 5:
+            lines.append('- loot one\n- loot two [/item/sun-blade]\n')
+        lines.append(' '.join(rng.choice(WORDS) for _ in range(60)) + f' footnote[^{i}]\n\n[^{i}]: note {i}\n')
+    return '\n'.join(lines)
+
+
+def renders_per_second(render, pages, repeat=3):
+    start = perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            render(page)
+    return repeat * len(pages) / (perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--paragraphs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    from website.page_editor import markdown_to_html, render_markdown
+
+    rng = random.Random(args.seed)
+    pages = [session_notes(rng, args.paragraphs) for _ in range(args.pages)]
+    with app.test_request_context():
+        print(f'{args.pages} pages of {len(pages[0]) // 1024} KB')
+        print(f'{"uncached":32s}{renders_per_second(render_markdown, pages):10.1f} renders/s')
+        # One pass only, later ones would already hit the cache
+        print(f'{"cache, first pass":32s}{renders_per_second(markdown_to_html, pages, repeat=1):10.1f} renders/s')
+        print(f'{"cache, warm":32s}{renders_per_second(markdown_to_html, pages):10.1f} renders/s')
+        short = [SHORT_PAGE] * 200
+        print(f'{"short pages, uncached":32s}{renders_per_second(render_markdown, short, repeat=1):10.1f} renders/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+from sqlalchemy import event, text, select, inspect, literal
+from markupsafe import Markup, escape
+from flask.cli import with_appcontext
+from time import perf_counter
+from slugify import slugify
+from .models import MODELS
+from . import db
+import click
+import re
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_TERMS = 10
+SNIPPET_TOKENS = 16
+# bm25 weight of a title match against a body match
+TITLE_WEIGHT = 10.0
+# Scoring every match of a very broad query ('the', 'npc') is what makes it slow,
+# past this many matches only the newest ones are ranked
+MAX_RANKED_MATCHES = 2000
+# The FTS table keeps prefix indexes of 2 and 3 characters, a single letter is
+# matched as a whole word instead of expanding to most of the vocabulary
+MIN_PREFIX_LENGTH = 2
+# model key -> (title column, body columns). The position of a model is part of
+# its documents' rowids, so new models go at the end.
+SEARCH_FIELDS = {
+    'page': ('title', ('content_md',)),
+    'session': ('name', ('description', 'notes')),
+    'spell': ('name', ('description',)),
+    'monster': ('name', ('description',)),
+    'npc': ('name', ('description',)),
+    'quest': ('title', ('summary', 'reward')),
+    'player': ('name', ('backstory', 'notes')),
+    'pathway': ('name', ('description',)),
+    'sequence': ('title', ('description',)),
+    'item': ('name', ('description',)),
+    'user': ('name', ()),
+    'fancontent': ('title', ('description',)),
+}
+# Matches come back between these and are turned into <mark> after escaping
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+# Low bits of a rowid that hold the model code. The stride does not depend on
+# the number of models, so adding one leaves the existing rowids alone
+MODEL_CODE_BITS = 5
+# Bump when the rowid scheme or the table layout changes, the index is then
+# rebuilt at startup
+SEARCH_INDEX_VERSION = 2
+
+_MODEL_CODES = {key: code for code, key in enumerate(SEARCH_FIELDS)}
+assert len(_MODEL_CODES) <= 1 << MODEL_CODE_BITS
+_MODEL_KEYS = {MODELS[key]: key for key in SEARCH_FIELDS}
+_search_enabled = False
+
+# search_index, its FTS5 shadow tables (search_index_data, _idx, _content,
+# _docsize, _config) and search_index_version
+SEARCH_TABLE_PREFIX = 'search_index'
+
+CREATE_SEARCH_INDEX = text("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        model, entry_id UNINDEXED, slug UNINDEXED, title, body,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+""")
+INSERT_DOCUMENT = text("""
+    INSERT OR REPLACE INTO search_index (rowid, model, entry_id, slug, title, body)
+    VALUES (:rowid, :model, :entry_id, :slug, :title, :body)
+""")
+DELETE_DOCUMENT = text("DELETE FROM search_index WHERE rowid = :rowid")
+CREATE_VERSION_TABLE = text("CREATE TABLE IF NOT EXISTS search_index_version (version INTEGER NOT NULL)")
+
+#---------------------------Documents-------------------------------------
+def _rowid(key, entry_id):
+    # One rowid per (model, id), so a document is replaced or deleted by primary key
+    return entry_id << MODEL_CODE_BITS | _MODEL_CODES[key]
+
+
+def _document(key, entry_id, slug, title, *body):
+    return {
+        'rowid': _rowid(key, entry_id),
+        'model': key,
+        'entry_id': entry_id,
+        'slug': slug or slugify(title or ''),
+        'title': title or '',
+        'body': '\n\n'.join(part for part in body if part),
+    }
+
+
+def _entry_document(key, target):
+    title, body = SEARCH_FIELDS[key]
+    return _document(key, target.id, getattr(target, 'slug', None), getattr(target, title),
+                     *(getattr(target, column) for column in body))
+
+
+def rebuild_search_index():
+    """Drops every document and indexes all searchable rows again, one column
+    only query per model. Returns the number of documents."""
+    db.session.execute(text('DELETE FROM search_index'))
+    total = 0
+    for key, (title, body) in SEARCH_FIELDS.items():
+        model = MODELS[key]
+        slug = model.slug if hasattr(model, 'slug') else literal(None)
+        columns = [getattr(model, column) for column in body]
+        rows = db.session.execute(select(model.id, slug, getattr(model, title), *columns)).all()
+        documents = [_document(key, *row) for row in rows]
+        if documents:
+            db.session.execute(INSERT_DOCUMENT, documents)
+        total += len(documents)
+    # A bulk load leaves many small segments behind, merged they are read far faster
+    db.session.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    db.session.commit()
+    return total
+
+
+def init_search_index(app):
+    """Creates the FTS5 table if needed and fills it when it is empty or was
+    built by another SEARCH_INDEX_VERSION, then turns on the listeners that keep
+    it in sync. Search stays off on databases other than SQLite."""
+    global _search_enabled
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            return
+        db.session.execute(CREATE_SEARCH_INDEX)
+        db.session.execute(CREATE_VERSION_TABLE)
+        version = db.session.execute(text('SELECT version FROM search_index_version')).scalar()
+        db.session.commit()
+        _search_enabled = True
+        if version != SEARCH_INDEX_VERSION:
+            rebuild_search_index()
+            db.session.execute(text('DELETE FROM search_index_version'))
+            db.session.execute(text('INSERT INTO search_index_version (version) VALUES (:version)'),
+                               {'version': SEARCH_INDEX_VERSION})
+            db.session.commit()
+        elif db.session.execute(text('SELECT rowid FROM search_index LIMIT 1')).first() is None:
+            rebuild_search_index()
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic autogenerate filter: the FTS5 table, its shadow tables and the
+    version table are created here with raw SQL, not declared in db.metadata,
+    so migrations must neither drop nor create them."""
+    table = name if type_ == 'table' else getattr(getattr(object, 'table', None), 'name', '')
+    return not (table or '').startswith(SEARCH_TABLE_PREFIX)
+
+#---------------------------Sync-------------------------------------
+# after_* rather than before_*, a new row only has its id once it is inserted.
+# The writes go through the flush's connection, so they commit or roll back
+# with the change itself.
+def _index_entry(__mapper, connection, target):
+    if _search_enabled:
+        connection.execute(INSERT_DOCUMENT, _entry_document(_MODEL_KEYS[type(target)], target))
+
+def _reindex_entry(mapper, connection, target):
+    if not _search_enabled:
+        return
+    title, body = SEARCH_FIELDS[_MODEL_KEYS[type(target)]]
+    state = inspect(target)
+    # Most updates (tokens, votes, levels) touch no searchable column
+    if any(state.attrs[column].history.has_changes() for column in ('slug', title, *body) if column in state.attrs):
+        _index_entry(mapper, connection, target)
+
+def _unindex_entry(__mapper, connection, target):
+    if _search_enabled:
+        connection.execute(DELETE_DOCUMENT, {'rowid': _rowid(_MODEL_KEYS[type(target)], target.id)})
+
+for model_class in _MODEL_KEYS:
+    event.listen(model_class, 'after_insert', _index_entry)
+    event.listen(model_class, 'after_update', _reindex_entry)
+    event.listen(model_class, 'after_delete', _unindex_entry)
+
+#---------------------------Queries-------------------------------------
+def match_expression(query, model=None):
+    """Turns what the user typed into an FTS5 query: every word has to match the
+    title or body and the last one may be a prefix. The model key is matched as
+    a token of its own column, so FTS5 intersects it with the words instead of
+    filtering rows afterwards. Returns None when there is no word in it."""
+    terms = re.findall(r'\w+', query)[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= MIN_PREFIX_LENGTH:
+        quoted[-1] += '*'
+    expression = f"{{title body}} : ({' '.join(quoted)})"
+    if model:
+        expression = f'model : "{model}" AND {expression}'
+    return expression
+
+
+def render_highlight(value):
+    """Escapes an FTS5 highlight/snippet and turns its markers into <mark>."""
+    value = str(escape(value))
+    return Markup(value.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+
+def search(query, page=1, limit=SEARCH_PAGE_SIZE, model=None):
+    """Returns (results, more, truncated) for one page of the best matches, ranked
+    by bm25 with title matches weighing TITLE_WEIGHT times a body match. Only the
+    newest MAX_RANKED_MATCHES matches are ranked, FTS5 walks them in rowid order
+    so the cutoff costs no more than reading that many ids. `truncated` tells
+    that older matches were left out, the caller should ask for a narrower query.
+    Each result has the model key, entry id, slug and the highlighted title and
+    snippet."""
+    expression = match_expression(query, model)
+    if expression is None or not _search_enabled:
+        return [], False, False
+    cutoff = db.session.execute(text("""
+        SELECT rowid FROM search_index WHERE search_index MATCH :expression
+        ORDER BY rowid DESC LIMIT 1 OFFSET :ranked
+    """), {'expression': expression, 'ranked': MAX_RANKED_MATCHES}).scalar()
+    sql = """
+        SELECT model, entry_id, slug,
+               highlight(search_index, 3, :start, :end) AS title,
+               snippet(search_index, 4, :start, :end, '…', :tokens) AS snippet
+        FROM search_index
+        WHERE search_index MATCH :expression
+          AND rowid > :cutoff
+        ORDER BY bm25(search_index, 0, 0, 0, :title_weight, 1.0)
+        LIMIT :limit OFFSET :offset
+    """
+    rows = db.session.execute(text(sql), {
+        'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END, 'tokens': SNIPPET_TOKENS,
+        'expression': expression, 'title_weight': TITLE_WEIGHT,
+        'cutoff': cutoff if cutoff is not None else -1, 'limit': limit + 1, 'offset': (page - 1) * limit,
+    }).all()
+    results = [{
+        'model': row.model,
+        'id': row.entry_id,
+        'slug': row.slug,
+        'title': render_highlight(row.title),
+        'snippet': render_highlight(row.snippet),
+    } for row in rows[:limit]]
+    return results, len(rows) > limit, cutoff is not None
+
+#---------------------------CLI-------------------------------------
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    """Index every page and entry again, e.g. after rows were changed with raw SQL."""
+    started = perf_counter()
+    total = rebuild_search_index()
+    click.echo(f'{total:,} documents indexed in {perf_counter() - started:.2f}s')
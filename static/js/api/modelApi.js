@@ -5,12 +5,23 @@ export function loadFields(model) {
   return fetchJSON(`/get-fields/${model}`);
 }
 
+export function loadChoices(model, { q = "", after = null, ids = null } = {}) {
+  const params = new URLSearchParams();
+  if (q) params.set("q", q);
+  if (after !== null) params.set("after", after);
+  if (ids) params.set("ids", ids.join(","));
+  return fetchJSON(`/get-choices/${model}?${params}`);
+}
+
 export function loadEntry(model, id) {
   return fetchJSON(`/get-entry/${model}/${id}`);
 }
 
-export function loadEntries(model) {
-  return fetchJSON(`/get-entries/${model}`);
+export function loadEntries(model, { q = "", after = null } = {}) {
+  const params = new URLSearchParams();
+  if (q) params.set("q", q);
+  if (after !== null) params.set("after", after);
+  return fetchJSON(`/get-entries/${model}?${params}`);
 }
 
 export function submitEntry(model, data, id = null) {
@@ -26,10 +37,29 @@ export function deleteEntry(model, id) {
   return fetch(`/delete-entry/${model}/${id}`, { method: "DELETE" });
 }
 
-export function getPageTree() {
-  return fetchJSON(`/api/pages/tree`);
+export function getPageTree(root = null, depth = null) {
+  const params = new URLSearchParams();
+  if (root !== null) params.set("root", root);
+  if (depth !== null) params.set("depth", depth);
+  const query = params.toString();
+  return fetchJSON(`/api/pages/tree${query ? `?${query}` : ""}`);
+}
+
+export function loadEntryByName(model, name, fields = null) {
+  const query = fields ? `?fields=${fields.join(",")}` : "";
+  return fetchJSON(`/get-entry-by-name/${model}/${name}${query}`);
+}
+
+export function loadEntriesByName(refs) {
+  return fetchJSON("/get-entries-by-name", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ refs }),
+  });
 }
 
-export function loadEntryByName(model, name) {
-  return fetchJSON(`/get-entry-by-name/${model}/${name}`);
+export function loadCompletions(model, q, limit = null) {
+  const params = new URLSearchParams({ q });
+  if (limit !== null) params.set("limit", limit);
+  return fetchJSON(`/autocomplete/${model}?${params}`);
 }
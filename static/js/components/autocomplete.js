@@ -0,0 +1,98 @@
+import { loadCompletions } from "../api/modelApi.js";
+import { debounce } from "./pageEditor.js";
+
+const COMPLETION_DELAY = 150; // ms after the last key
+// [/model/partial name right before the caret
+const OPEN_LINK_PATTERN = /\[\/(\w{1,50})\/([\w \t-]{1,200})$/;
+
+////////////////////////////////////////////////////////////////////////
+// Parent page picker: the text input completes page titles, the hidden
+// parent_id holds the id of the picked one (empty for no parent).
+export function initParentPicker(form) {
+  const search = form.querySelector("#parent-search");
+  const options = form.querySelector("#parent-options");
+  const parentId = form.querySelector("#parent_id");
+  if (!search || !options || !parentId) return;
+  const exclude = search.dataset.exclude;
+  let byLabel = new Map();
+  if (search.value) byLabel.set(search.value, parentId.value);
+
+  const refresh = debounce(async () => {
+    const q = search.value.trim();
+    if (!q) return;
+    try {
+      const { results } = await loadCompletions("page", q);
+      byLabel = new Map(
+        results.filter((r) => String(r.id) !== exclude).map((r) => [r.label, r.id])
+      );
+      options.replaceChildren(
+        ...[...byLabel.keys()].map((label) => new Option(label))
+      );
+    } catch (err) {
+      console.error("Parent completion failed:", err);
+    }
+  }, COMPLETION_DELAY);
+
+  search.addEventListener("input", () => {
+    // Text that is not a completed title means no parent, as it reads
+    parentId.value = byLabel.get(search.value.trim()) ?? "";
+    refresh();
+  });
+}
+
+////////////////////////////////////////////////////////////////////////
+// [/model/name] links: typing [/npc/ala lists the matching entries below the
+// textarea, picking one finishes the link.
+export function initLinkCompletion(textarea, list) {
+  if (!textarea || !list) return;
+
+  const hide = () => {
+    list.hidden = true;
+    list.replaceChildren();
+  };
+
+  const insert = (start, name) => {
+    const caret = textarea.selectionStart;
+    const before = textarea.value.slice(0, start);
+    const after = textarea.value.slice(caret).replace(/^[^\]\n]*\]/, "");
+    textarea.value = `${before}${name}]${after}`;
+    textarea.selectionStart = textarea.selectionEnd = before.length + name.length + 1;
+    textarea.focus();
+    hide();
+    textarea.dispatchEvent(new Event("input", { bubbles: true }));
+  };
+
+  const complete = debounce(async () => {
+    const caret = textarea.selectionStart;
+    const match = textarea.value.slice(0, caret).match(OPEN_LINK_PATTERN);
+    if (!match) return hide();
+    const [, model, partial] = match;
+    const start = caret - partial.length;
+    try {
+      const { results } = await loadCompletions(model, partial);
+      if (!results || results.length === 0) return hide();
+      list.replaceChildren(
+        ...results.map((r) => {
+          const item = document.createElement("li");
+          // Link names only take word characters, spaces and dashes
+          const name = /^[\w \t-]+$/.test(r.label) ? r.label : r.slug;
+          item.textContent = r.label;
+          item.addEventListener("mousedown", (e) => {
+            e.preventDefault();
+            insert(start, name);
+          });
+          return item;
+        })
+      );
+      list.hidden = false;
+    } catch {
+      hide(); // unknown model
+    }
+  }, COMPLETION_DELAY);
+
+  textarea.addEventListener("input", complete);
+  textarea.addEventListener("keydown", (e) => {
+    if (e.key === "Escape") hide();
+  });
+  textarea.addEventListener("blur", hide);
+}
@@ -0,0 +1,62 @@
+import { loadChoices } from "../api/modelApi.js";
+import { createElement } from "../dom/domUtils.js";
+
+// choiceLoader.js
+// Pages the choices of a foreign key or relationship field in from /get-choices,
+// with a search box and a "Load more" button, instead of shipping the whole table.
+// `load`/`key` point it at another keyset paginated listing, e.g. /get-entries.
+export function createChoiceLoader(
+  model,
+  onChoices,
+  { load = loadChoices, key = "choices", delay = 300 } = {}
+) {
+  let query = "";
+  let next = null;
+  let loaded = false;
+  let timeout;
+
+  const search = createElement("input", {
+    type: "search",
+    className: "form-control form-control-sm mb-2",
+    placeholder: "Search...",
+  });
+  const moreButton = createElement("button", {
+    type: "button",
+    className: "btn btn-link btn-sm",
+    textContent: "Load more",
+  });
+  moreButton.style.display = "none";
+
+  async function loadPage(reset) {
+    try {
+      const page = await load(model, {
+        q: query,
+        after: reset ? null : next,
+      });
+      onChoices(page[key], reset);
+      next = page.next;
+      moreButton.style.display = next === null ? "none" : "inline-block";
+      loaded = true;
+    } catch (err) {
+      console.error("Loading choices failed:", err);
+    }
+  }
+
+  search.addEventListener("input", () => {
+    clearTimeout(timeout);
+    timeout = setTimeout(() => {
+      query = search.value.trim();
+      loadPage(true);
+    }, delay);
+  });
+  moreButton.addEventListener("click", (e) => {
+    e.preventDefault();
+    loadPage(false);
+  });
+
+  return {
+    search,
+    moreButton,
+    loadOnce: () => (loaded ? Promise.resolve() : loadPage(true)),
+  };
+}
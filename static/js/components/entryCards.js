@@ -1,23 +1,38 @@
 import { loadEntries } from "../api/modelApi.js";
 import { createElement } from "../dom/domUtils.js";
+import { createChoiceLoader } from "./choiceLoader.js";
 
-export async function renderEntryCards(model, onClick) {
+// Pages the entries of a model in, with a search box. onEntries(entries, reset)
+// lets the caller mirror every page (e.g. into the edit dropdown).
+export async function renderEntryCards(model, onClick, onEntries = () => {}) {
   const entryList = document.getElementById("entryList");
   entryList.innerHTML = "<p>Loading entries...</p>";
 
+  const cards = createElement("div");
+  const loader = createChoiceLoader(
+    model,
+    (entries, reset) => {
+      if (reset) cards.innerHTML = "";
+      entries.forEach((entry) => {
+        const card = createElement("div", {
+          className: "entry-card",
+          textContent: entry.label,
+        });
+        card.dataset.id = entry.id;
+        card.addEventListener("click", () => onClick(entry.id));
+        cards.appendChild(card);
+      });
+      onEntries(entries, reset);
+    },
+    { load: loadEntries, key: "entries" }
+  );
+
   try {
-    const entries = await loadEntries(model);
+    await loader.loadOnce();
     entryList.innerHTML = "";
-
-    entries.forEach((entry) => {
-      const card = createElement("div", {
-        className: "entry-card",
-        textContent: entry.label,
-      });
-      card.dataset.id = entry.id;
-      card.addEventListener("click", () => onClick(entry.id));
-      entryList.appendChild(card);
-    });
+    entryList.appendChild(loader.search);
+    entryList.appendChild(cards);
+    entryList.appendChild(loader.moreButton);
   } catch (err) {
     entryList.innerHTML = "<p>Error loading entries.</p>";
     console.error(err);
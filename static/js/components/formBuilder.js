@@ -1,6 +1,8 @@
 import { formatDateTimeLocal, formatKey } from "../dom/domUtils.js";
+import { loadChoices } from "../api/modelApi.js";
 // formBuilder.js
 import { createElement } from "../dom/domUtils.js";
+import { createChoiceLoader } from "./choiceLoader.js";
 
 export function buildForm(fields, data = {}, model, onDeleteClick = null) {
   const form = document.getElementById("dynamicForm");
@@ -16,6 +18,7 @@ export function buildForm(fields, data = {}, model, onDeleteClick = null) {
     });
 
     let input;
+    const extras = [];
 
     if (field.type === "relationship" && field.relationship_type === "many") {
       // Render multiple checkboxes
@@ -60,7 +63,10 @@ export function buildForm(fields, data = {}, model, onDeleteClick = null) {
         className: "collapsible-checkboxes",
         style: "display: none;", // hidden initially
       });
-      (field.choices || []).forEach((choice) => {
+      const renderedIds = new Set();
+      const appendChoice = (choice) => {
+        if (renderedIds.has(choice.id)) return;
+        renderedIds.add(choice.id);
         const checkboxId = `field-${field.name}-${choice.id}`;
 
         const checkboxWrapper = createElement("div", {
@@ -101,14 +107,26 @@ export function buildForm(fields, data = {}, model, onDeleteClick = null) {
         checkboxLabel.appendChild(labelLink);
         checkboxWrapper.appendChild(checkbox);
         checkboxWrapper.appendChild(checkboxLabel);
-        collapsibleDiv.appendChild(checkboxWrapper);
-      });
+        choiceList.appendChild(checkboxWrapper);
+      };
+      // Already linked entries are known from the entry itself, the rest is paged in on demand
+      const choiceList = createElement("div");
+      (data[field.name] || []).forEach((item) =>
+        appendChoice({ id: item.id, label: item.name })
+      );
+      const loader = createChoiceLoader(field.choices_model, (choices) =>
+        choices.forEach(appendChoice)
+      );
+      collapsibleDiv.appendChild(loader.search);
+      collapsibleDiv.appendChild(choiceList);
+      collapsibleDiv.appendChild(loader.moreButton);
       // Toggle logic
       toggleButton.addEventListener("click", (e) => {
         e.preventDefault();
         if (collapsibleDiv.style.display === "none") {
           collapsibleDiv.style.display = "block";
           toggleButton.textContent = "Hide options";
+          loader.loadOnce();
         } else {
           collapsibleDiv.style.display = "none";
           toggleButton.textContent = "Show options";
@@ -149,7 +167,6 @@ export function buildForm(fields, data = {}, model, onDeleteClick = null) {
           break;
 
         case "enum":
-        case "foreignkey":
           input = createElement("select");
           input.appendChild(
             createElement("option", {
@@ -159,20 +176,58 @@ export function buildForm(fields, data = {}, model, onDeleteClick = null) {
           );
 
           (field.choices || []).forEach((choice) => {
-            const isEnum = field.type === "enum";
-            const optionValue = isEnum ? choice : choice.id;
-            const optionLabel = isEnum ? choice : choice.label;
-
             input.appendChild(
               createElement("option", {
-                value: optionValue,
-                textContent: optionLabel,
-                selected: data[field.name] === optionValue,
+                value: choice,
+                textContent: choice,
+                selected: data[field.name] === choice,
               })
             );
           });
           break;
 
+        case "foreignkey":
+          input = createElement("select");
+          input.appendChild(
+            createElement("option", {
+              value: "",
+              textContent: "-- None --",
+            })
+          );
+          if (field.choices_model) {
+            const select = input;
+            const appendOption = (choice) => {
+              if (select.querySelector(`option[value="${choice.id}"]`)) return;
+              select.appendChild(
+                createElement("option", {
+                  value: choice.id,
+                  textContent: choice.label,
+                  selected: data[field.name] === choice.id,
+                })
+              );
+            };
+            // Only the current value is resolved up front, the rest loads when the dropdown is used
+            if (data[field.name] != null) {
+              loadChoices(field.choices_model, { ids: [data[field.name]] }).then(
+                (page) => page.choices.forEach(appendOption)
+              );
+            }
+            const loader = createChoiceLoader(
+              field.choices_model,
+              (choices, reset) => {
+                if (reset) {
+                  select
+                    .querySelectorAll("option:not(:checked)")
+                    .forEach((option) => option.value && option.remove());
+                }
+                choices.forEach(appendOption);
+              }
+            );
+            select.addEventListener("focus", () => loader.loadOnce());
+            extras.push(loader.search, loader.moreButton);
+          }
+          break;
+
         default:
           input = createElement("input", {
             type: "text",
@@ -199,6 +254,7 @@ export function buildForm(fields, data = {}, model, onDeleteClick = null) {
 
     wrapper.appendChild(label);
     wrapper.appendChild(input);
+    extras.forEach((el) => wrapper.appendChild(el));
     form.appendChild(wrapper);
     setupNoneCheckboxLogic(field.name);
   });
@@ -254,19 +310,18 @@ export function setupNoneCheckboxLogic(fieldName) {
 
   if (!input || !noneCheckbox) return;
 
-  noneCheckbox.addEventListener("change", () => {
-    if (noneCheckbox.checked) {
-      input.querySelectorAll(`input[name="${fieldName}[]"]`).forEach((cb) => {
-        if (cb !== noneCheckbox) cb.checked = false;
-      });
-    }
-  });
-
-  input.querySelectorAll(`input[name="${fieldName}[]"]`).forEach((cb) => {
-    if (cb !== noneCheckbox) {
-      cb.addEventListener("change", () => {
-        if (cb.checked) noneCheckbox.checked = false;
-      });
+  // Delegated, since the other checkboxes are paged in later
+  input.addEventListener("change", (e) => {
+    const cb = e.target;
+    if (cb.name !== `${fieldName}[]`) return;
+    if (cb === noneCheckbox) {
+      if (noneCheckbox.checked) {
+        input.querySelectorAll(`input[name="${fieldName}[]"]`).forEach((other) => {
+          if (other !== noneCheckbox) other.checked = false;
+        });
+      }
+    } else if (cb.checked) {
+      noneCheckbox.checked = false;
     }
   });
 }
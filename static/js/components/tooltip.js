@@ -1,4 +1,8 @@
-import { loadEntry, loadEntryByName } from "../api/modelApi.js";
+import {
+  loadEntry,
+  loadEntryByName,
+  loadEntriesByName,
+} from "../api/modelApi.js";
 import { formatKey } from "../dom/domUtils.js";
 
 const MAX_RELATED = 3;
@@ -6,11 +10,41 @@ const MAX_RELATED = 3;
 // Assuming loadEntry(model, id) is imported or available
 
 const tooltipContainer = document.getElementById("tooltip-container");
+// model -> slug -> tooltip data, filled from the page or one batch request
+const tooltipCache = {};
+
+////////////////////////////////////////////////////////////////////////
+export async function prefetchTooltips() {
+  const embedded = document.getElementById("tooltip-data");
+  if (embedded) {
+    cacheEntries(JSON.parse(embedded.textContent));
+  }
+
+  // Links the server did not embed (e.g. the editor preview) are resolved together
+  const missing = [];
+  document.querySelectorAll("a[data-model][data-name]").forEach((link) => {
+    const { model, name } = link.dataset;
+    if (!tooltipCache[model]?.[name]) missing.push([model, name]);
+  });
+  if (missing.length === 0) return;
+  try {
+    cacheEntries(await loadEntriesByName(missing));
+  } catch (err) {
+    console.error("Tooltip prefetch failed:", err);
+  }
+}
+
+function cacheEntries(entries) {
+  for (const [model, byName] of Object.entries(entries)) {
+    tooltipCache[model] = { ...tooltipCache[model], ...byName };
+  }
+}
 
 ////////////////////////////////////////////////////////////////////////
 export async function showTooltip(model, name, event) {
   try {
-    const data = await loadEntryByName(model, name);
+    const data =
+      tooltipCache[model]?.[name] || (await loadEntryByName(model, name));
     if (!data) {
       tooltipContainer.textContent = "No data found";
       return;
@@ -70,8 +104,8 @@ function formatTooltipContent(data) {
 
       // Assume any string ending with an image extension is an image path
       if (/\.(jpe?g|png|gif|bmp|webp|ico)$/i.test(valStr)) {
-        // Prepend /media/ to the path
-        const imageUrl = `/media/${valStr.replace(/^\/+/, "")}`;
+        // The tooltip only needs the smallest derivative of the image
+        const imageUrl = `/media/thumbnail/${valStr.replace(/^\/+/, "")}`;
         displayValue = `<img src="${imageUrl}" alt="${key}" style="max-width: 100%; max-height: 150px; border-radius: 6px;" />`;
       } else {
         displayValue = valStr;
@@ -0,0 +1,109 @@
+import { showFlashMessage } from "../dom/flashMessages.js";
+
+// Recordings bigger than the single request limit are sent in chunks through
+// /upload/chunked. The upload id is kept in localStorage per file, so picking the
+// same file again after a dropped connection resumes where the server left off.
+// Files that fit in one request are hashed first, content the server already
+// stores is then added under the new name without sending it again.
+
+async function sha256Hex(file) {
+  // crypto.subtle only exists on https and localhost
+  if (!window.crypto || !window.crypto.subtle) return null;
+  const hash = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(hash), (b) => b.toString(16).padStart(2, "0")).join("");
+}
+
+export async function linkExisting(file) {
+  const digest = await sha256Hex(file);
+  if (!digest) return false;
+  const resp = await fetch("/upload/link", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename: file.name, digest }),
+  });
+  if (resp.status === 404) return false;
+  const data = await resp.json();
+  if (!resp.ok) throw new Error(data.error || "Upload failed");
+  return true;
+}
+
+function resumeKey(file) {
+  return `chunked-upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function startOrResume(file) {
+  const saved = localStorage.getItem(resumeKey(file));
+  if (saved) {
+    const resp = await fetch(`/upload/chunked/${saved}`);
+    if (resp.ok) {
+      const data = await resp.json();
+      return { uploadId: saved, offset: data.offset };
+    }
+    localStorage.removeItem(resumeKey(file));
+  }
+  const resp = await fetch("/upload/chunked", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  });
+  const data = await resp.json();
+  if (!resp.ok) throw new Error(data.error || "Upload failed");
+  localStorage.setItem(resumeKey(file), data.upload_id);
+  return { uploadId: data.upload_id, offset: data.offset, chunkSize: data.chunk_size };
+}
+
+export async function uploadInChunks(file, onProgress, chunkSize = 8 * 1024 * 1024) {
+  const started = await startOrResume(file);
+  const uploadId = started.uploadId;
+  let offset = started.offset;
+  chunkSize = started.chunkSize || chunkSize;
+
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + chunkSize);
+    const resp = await fetch(`/upload/chunked/${uploadId}?offset=${offset}`, {
+      method: "PUT",
+      body: chunk,
+    });
+    const data = await resp.json();
+    // 409 tells where the server actually is, carry on from there
+    if (!resp.ok && resp.status !== 409) throw new Error(data.error || "Upload failed");
+    offset = data.offset;
+    if (onProgress) onProgress(offset / file.size);
+    if (data.done) break;
+  }
+  localStorage.removeItem(resumeKey(file));
+}
+
+export function initChunkedUpload() {
+  const form = document.querySelector(".upload-form[data-max-size]");
+  if (!form) return;
+  const maxSize = Number(form.dataset.maxSize);
+  const chunkedTypes = form.dataset.chunkedTypes.split(",");
+  const input = form.querySelector("input[type='file']");
+  const label = document.getElementById("file-label");
+
+  form.addEventListener("submit", async (e) => {
+    const file = input.files[0];
+    if (!file) return;
+    const ext = file.name.split(".").pop().toLowerCase();
+    if (file.size > maxSize && !chunkedTypes.includes(ext)) return; // the server answers with the size error
+    e.preventDefault();
+    if (file.size <= maxSize) {
+      // Small files use the normal form post unless the server has them already
+      try {
+        if (await linkExisting(file)) return window.location.reload();
+      } catch (err) {
+        return showFlashMessage(err.message, "error");
+      }
+      return form.submit();
+    }
+    try {
+      await uploadInChunks(file, (done) => {
+        if (label) label.textContent = `${file.name} (${Math.floor(done * 100)}%)`;
+      });
+      window.location.reload();
+    } catch (err) {
+      showFlashMessage(`${err.message}, submit again to resume.`, "error");
+    }
+  });
+}
@@ -1,63 +1,61 @@
-let currentPage = 1;
-let allLogs = [];
-let maxPage = 1;
-
-export async function initPullHistory(pageSize = 20) {
-  const resp = await fetch(`/pull-history/2000`, { method: "GET" });
-  allLogs = await resp.json();
-  maxPage = Math.ceil(allLogs.length / pageSize);
-  loadPullHistory();
+let currentPage = 0;
+let pageSize = 20;
+// cursors[n] is where page n starts, pages are fetched from the server on demand
+let cursors = [null];
+
+export async function initPullHistory(size = 20) {
+  if (!document.getElementById("pull-history-list")) return;
+  pageSize = size;
+  await loadPullHistory();
   pullPagination();
 }
 
-export async function loadPullHistory(page = 1, no = 20) {
-  const startIndex = (page - 1) * no;
-  const endIndex = page * no;
-  const pageLogs = allLogs.slice(startIndex, endIndex);
+export async function loadPullHistory(page = 0) {
+  if (page === 0) cursors = [null];
+  const params = new URLSearchParams({ limit: pageSize });
+  if (cursors[page]) params.set("cursor", cursors[page]);
+  const resp = await fetch(`/pull-history?${params}`, { method: "GET" });
+  const data = await resp.json();
+  currentPage = page;
+  cursors[page + 1] = data.next;
+
   const historyContainer = document.getElementById("pull-history-list");
   if (historyContainer) {
     historyContainer.innerHTML = "";
-    pageLogs.forEach((item) => {
+    data.history.forEach((item) => {
       const logDiv = document.createElement("div");
       logDiv.className = `pull-history-item ${item.rarity}`;
       logDiv.innerHTML = `<strong>${item.name}</strong>— ${item.pulled_at}`;
-      // prepend so latest is on top
+      // newest first, as sent by the server
       historyContainer.append(logDiv);
     });
   }
+  updatePaginationButtons();
+}
+
+function updatePaginationButtons() {
+  const prevBtn = document.getElementById("prev-page-btn");
+  const nextBtn = document.getElementById("next-page-btn");
+  if (prevBtn) prevBtn.disabled = currentPage <= 0;
+  if (nextBtn) nextBtn.disabled = !cursors[currentPage + 1];
 }
+
 export async function pullPagination() {
   const prevBtn = document.getElementById("prev-page-btn");
   const nextBtn = document.getElementById("next-page-btn");
-  if (prevBtn || nextBtn) {
-    if (currentPage <= 1) {
-      prevBtn.disabled = true;
-    }
-    if (currentPage >= maxPage) {
-      nextBtn.disabled = true;
-    }
-  }
   if (prevBtn) {
     prevBtn.addEventListener("click", async () => {
-      if (currentPage > 1) {
-        currentPage--;
-        await loadPullHistory(currentPage);
-        if (currentPage <= 1) {
-          prevBtn.disabled = true;
-        }
-        nextBtn.disabled = false;
+      if (currentPage > 0) {
+        await loadPullHistory(currentPage - 1);
       }
     });
   }
 
   if (nextBtn) {
     nextBtn.addEventListener("click", async () => {
-      currentPage++;
-      prevBtn.disabled = false;
-      if (currentPage >= maxPage) {
-        nextBtn.disabled = true;
+      if (cursors[currentPage + 1]) {
+        await loadPullHistory(currentPage + 1);
       }
-      await loadPullHistory(currentPage);
     });
   }
 }
@@ -154,7 +152,9 @@ function showNextItem(
   const itemDiv = document.createElement("div");
   itemDiv.className = `pulled-item-display ${item.rarity} enlarged`;
   itemDiv.innerHTML = `
-        <img src="/media/${item.image}" alt="${item.name}" />
+        <img src="/media/${item.image}" ${
+          item.srcset ? `srcset="${item.srcset}" sizes="(max-width: 600px) 90vw, 500px"` : ""
+        } alt="${item.name}" />
         <p><strong>${item.name}</strong></p>
         <p>${item.description}</p>
       `;
@@ -188,7 +188,7 @@ function skipAll(queue, skipButton, skipAllButton, foreground, background) {
 
     // Enhanced HTML structure for better display
     itemDiv.innerHTML = `
-      <img src="/media/${item.image}" alt="${item.name}" />
+      <img src="${item.thumbnail || `/media/${item.image}`}" alt="${item.name}" />
       <p><strong>${item.name}</strong></p>
       <p>${item.description}</p>
     `;
@@ -1,5 +1,5 @@
 // pageHandlers.js
-import { loadFields, loadEntry, loadEntries } from '../api/modelApi.js';
+import { loadFields, loadEntry } from '../api/modelApi.js';
 import { buildForm } from '../components/formBuilder.js';
 import { handleDelete } from './formHandlers.js';
 import { renderEntryCards } from '../components/entryCards.js';
@@ -11,17 +11,18 @@ export async function handleModelChange(model, elements) {
   editEntrySelect.innerHTML = '<option>Loading...</option>';
 
   try {
-    const entries = await loadEntries(model);
-    editEntrySelect.innerHTML = '<option value="" disabled selected>Select entry</option>';
-    entries.forEach(entry => {
-      const option = document.createElement('option');
-      option.value = entry.id;
-      option.textContent = entry.label;
-      editEntrySelect.appendChild(option);
+    loadAndShowForm(model, null, formContainer)
+    // The dropdown follows the pages (and searches) of the entry cards
+    await renderEntryCards(model, (id) => loadAndShowForm(model, id, formContainer), (entries, reset) => {
+      if (reset) editEntrySelect.innerHTML = '<option value="" disabled selected>Select entry</option>';
+      entries.forEach(entry => {
+        const option = document.createElement('option');
+        option.value = entry.id;
+        option.textContent = entry.label;
+        editEntrySelect.appendChild(option);
+      });
     });
     editEntrySelect.disabled = false;
-    loadAndShowForm(model, null, formContainer)
-    await renderEntryCards(model, (id) => loadAndShowForm(model, id, formContainer));
   } catch (err) {
     console.error(err);
   }
@@ -0,0 +1,97 @@
+import { createElement } from "../dom/domUtils.js";
+
+// The first page of sessions is rendered by the server, the rest are appended
+// from /api/sessions as the end of the list scrolls into view.
+let nextCursor = null;
+let loading = false;
+
+export function initSessionBrowser() {
+  const list = document.getElementById("session-browser-list");
+  const sentinel = document.getElementById("session-browser-sentinel");
+  if (!list || !sentinel) return;
+  nextCursor = list.dataset.next || null;
+  if (!nextCursor) return;
+
+  const observer = new IntersectionObserver(
+    async (entries) => {
+      if (!entries.some((entry) => entry.isIntersecting)) return;
+      await loadMoreSessions(list);
+      if (!nextCursor) observer.disconnect();
+    },
+    { rootMargin: "400px" }
+  );
+  observer.observe(sentinel);
+}
+
+async function loadMoreSessions(list) {
+  if (loading || !nextCursor) return;
+  loading = true;
+  try {
+    const params = new URLSearchParams({ cursor: nextCursor });
+    const resp = await fetch(`/api/sessions?${params}`, { method: "GET" });
+    const data = await resp.json();
+    if (!resp.ok) throw new Error(data.error || "Failed to load sessions");
+    data.sessions.forEach((session) => list.append(renderSession(session)));
+    nextCursor = data.next;
+  } catch (err) {
+    console.error(err);
+    nextCursor = null;
+  } finally {
+    loading = false;
+  }
+}
+
+function field(label, value) {
+  return createElement("p", {}, [
+    createElement("strong", { textContent: `${label}:` }),
+    document.createTextNode(` ${value ?? ""}`),
+  ]);
+}
+
+// Same markup as the items of templates/sessions.html
+function renderSession(session) {
+  const left = createElement("div", { className: "session-left" }, [
+    createElement("h3", {
+      textContent: `${session.campaign_name} - Session ${session.session_no}`,
+    }),
+    field("Date", session.session_date || "Unknown"),
+    field("Title", session.name),
+  ]);
+  if (session.image) {
+    left.append(
+      createElement("div", { className: "session-logo" }, [
+        createElement("img", {
+          className: "session-browser-image",
+          attributes: { src: session.image, alt: `Image for ${session.name}` },
+        }),
+      ])
+    );
+  }
+
+  const middle = createElement("div", { className: "session-middle" }, [
+    field("Description", session.description),
+    field("The summary of the session", session.notes),
+  ]);
+
+  const memes = createElement(
+    "div",
+    { className: "session-memes" },
+    session.memes.map((meme) =>
+      createElement("a", { attributes: { href: meme.url } }, [
+        createElement("img", {
+          attributes: {
+            src: meme.thumbnail,
+            alt: `Meme for ${session.name}`,
+            loading: "lazy",
+          },
+        }),
+      ])
+    )
+  );
+
+  return createElement("li", { className: "session-browser-item" }, [
+    left,
+    middle,
+    memes,
+  ]);
+}
@@ -7,8 +7,10 @@ import {
   cancelHide,
   hideTooltipDelayed,
   getTooltipContainer,
+  prefetchTooltips,
 } from "./components/tooltip.js";
 import { submitPage, debounce, autosavePage } from "./components/pageEditor.js";
+import { initParentPicker, initLinkCompletion } from "./components/autocomplete.js";
 import { deleteEntry } from "./api/modelApi.js";
 /* import { gallery } from "./dom/gallery.js"; */
 import {
@@ -17,6 +19,8 @@ import {
   loadPullHistory,
   pullPagination,
 } from "./handlers/handle_pull.js";
+import { initSessionBrowser } from "./handlers/sessionBrowser.js";
+import { initChunkedUpload } from "./handlers/chunkedUpload.js";
 
 document.addEventListener("DOMContentLoaded", () => {
   //entry management
@@ -67,6 +71,7 @@ document.addEventListener("DOMContentLoaded", () => {
   //Tooltip
 
   const tooltipContainer = getTooltipContainer();
+  prefetchTooltips();
   if (window.matchMedia("(hover: hover)").matches) {
     document.body.addEventListener(
       "pointerenter",
@@ -212,6 +217,11 @@ document.addEventListener("DOMContentLoaded", () => {
     //autosave
     const debouncedSave = debounce(() => autosavePage(pageForm), 3000); // 3s delay
     pageForm.addEventListener("input", debouncedSave);
+    initParentPicker(pageForm);
+    initLinkCompletion(
+      document.getElementById("content_md"),
+      document.getElementById("link-suggestions")
+    );
   }
   if (pageForm && deletePageBtn) {
     deletePageBtn.addEventListener("click", async () => {
@@ -275,6 +285,9 @@ document.addEventListener("DOMContentLoaded", () => {
   }
   initPullHistory();
 
+  /*--------------------------------------sessions--------------------------------------------------*/
+  initSessionBrowser();
+
   /*--------------------------------------Galery--------------------------------------------------*/
   const modal = document.getElementById("media-modal");
   const modalContent = document.getElementById("modal-content");
@@ -289,7 +302,8 @@ document.addEventListener("DOMContentLoaded", () => {
 
         if (el.tagName.toLowerCase() === "img") {
           const img = new Image();
-          img.src = el.src;
+          // The grid shows a thumbnail, the modal gets the original file
+          img.src = el.closest(".gallery-item").dataset.src || el.src;
           modalContent.appendChild(img);
         } else {
           const src = el.querySelector("source")?.src || el.getAttribute("src");
@@ -318,6 +332,7 @@ document.addEventListener("DOMContentLoaded", () => {
     if (e.key === "Escape") closeModal();
   });
   /*--------------------------------------upload--------------------------------------------------*/
+  initChunkedUpload();
   const uploadLabel = document.getElementById("media");
   if (uploadLabel) {
     uploadLabel.addEventListener("change", function () {
@@ -0,0 +1,83 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+# The repository is the `website` package itself, import it under that name
+ROOT = Path(__file__).resolve().parents[1]
+if 'website' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('website', ROOT / '__init__.py',
+                                                  submodule_search_locations=[str(ROOT)])
+    website = importlib.util.module_from_spec(spec)
+    sys.modules['website'] = website
+    spec.loader.exec_module(website)
+
+from website import create_app, db  # noqa: E402
+from website.models import User  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('website')
+    app = create_app({
+        'TESTING': True,
+        # A file, so threads get their own connections to the same database
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{folder / 'test.db'}",
+        'UPLOAD_FOLDER': str(folder / 'media'),
+        'MEDIA_RECONCILE_INTERVAL': 0,
+    })
+    return app
+
+
+@pytest.fixture
+def app_ctx(app):
+    """An app context over empty tables."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def user(app_ctx):
+    user = User(email='gm@example.com', name='Gm', password=generate_password_hash('secret1'),
+                is_admin=True, tokens=1000, votes_remaining=3)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client(app_ctx, user):
+    client = app_ctx.test_client()
+    client.post('/login', data={'email': 'gm@example.com', 'password': 'secret1'})
+    return client
+
+
+class QueryCounter:
+    """Counts the statements sent to the database inside a `with` block."""
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self._record)
+
+
+@pytest.fixture
+def count_queries(app_ctx):
+    return QueryCounter
@@ -0,0 +1,95 @@
+import random
+from datetime import datetime, timedelta
+
+from website import db
+from website.comment_tree import load_comment_threads, MAX_COMMENT_DEPTH, COMMENTS_PAGE_SIZE
+from website.models import Comment, Page
+
+START = datetime(2024, 1, 1)
+
+
+def make_page(slug):
+    page = Page(title=slug.title(), slug=slug, content='<p>Session notes</p>')
+    db.session.add(page)
+    db.session.commit()
+    return page
+
+
+def add_comments(page, user, count, parent_of):
+    """Adds `count` comments, parent_of(ids so far) picks each one's parent id."""
+    ids = []
+    for i in range(count):
+        comment = Comment(page_id=page.id, parent_id=parent_of(ids), user_id=user.id,
+                          comment_text=f'Comment {i}', created_at=START + timedelta(seconds=i))
+        db.session.add(comment)
+        db.session.flush()
+        ids.append(comment.id)
+    db.session.commit()
+    return ids
+
+
+def count_page_queries(client, count_queries, slug):
+    client.get(f'/wiki/{slug}')  # warm the page tree and the login
+    with count_queries() as counter:
+        response = client.get(f'/wiki/{slug}')
+    assert response.status_code == 200
+    return counter.count
+
+
+def test_nested_comments_render_in_a_fixed_number_of_queries(client, user, count_queries):
+    small = make_page('small')
+    add_comments(small, user, 2, lambda ids: ids[-1] if ids else None)
+    rng = random.Random(3)
+    nested = make_page('nested')
+    add_comments(nested, user, 500, lambda ids: rng.choice(ids) if ids and rng.random() < 0.8 else None)
+    chain = make_page('chain')
+    add_comments(chain, user, 500, lambda ids: ids[-1] if ids else None)
+
+    small_queries = count_page_queries(client, count_queries, 'small')
+    assert count_page_queries(client, count_queries, 'nested') == small_queries
+    assert count_page_queries(client, count_queries, 'chain') == small_queries
+
+
+def test_threads_load_in_one_query(app_ctx, user, count_queries):
+    page = make_page('threads')
+    rng = random.Random(5)
+    add_comments(page, user, 500, lambda ids: rng.choice(ids) if ids and rng.random() < 0.8 else None)
+    page_id = page.id
+
+    with count_queries() as counter:
+        roots, cursor = load_comment_threads(page_id)
+    assert counter.count == 1
+    assert len(roots) == COMMENTS_PAGE_SIZE
+    assert cursor is not None
+
+
+def test_replies_past_the_max_depth_are_cut_off(app_ctx, user):
+    page = make_page('deep')
+    ids = add_comments(page, user, 20, lambda ids: ids[-1] if ids else None)
+
+    roots, cursor = load_comment_threads(page.id)
+    assert cursor is None
+    node, depth = roots[0], 0
+    while node.replies:
+        assert node.more_replies == 0
+        node, depth = node.replies[0], depth + 1
+    assert depth == MAX_COMMENT_DEPTH
+    # The deepest loaded comment only knows its thread goes on
+    assert node.more_replies == 1
+
+    # The thread view starts counting again from that comment
+    (continued,), _ = load_comment_threads(page.id, thread_id=node.id)
+    assert continued.id == ids[MAX_COMMENT_DEPTH]
+    assert continued.replies[0].id == ids[MAX_COMMENT_DEPTH + 1]
+
+
+def test_pages_of_threads_cover_every_comment(app_ctx, user):
+    page = make_page('paged')
+    add_comments(page, user, 50, lambda ids: None)
+    seen, cursor = [], None
+    while True:
+        roots, cursor = load_comment_threads(page.id, cursor)
+        seen.extend(root.id for root in roots)
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 50
@@ -0,0 +1,99 @@
+import threading
+
+from werkzeug.security import generate_password_hash
+
+from website import db, counters
+from website.models import FanContent, Session, User
+
+THREADS = 8
+
+
+def run_threads(app, attempts, work):
+    """Runs `work()` `attempts` times on each of THREADS threads, every call in
+    its own app context (own session and connection) and committed on its own.
+    Returns every value work() returned."""
+    results = []
+    results_lock = threading.Lock()
+    start = threading.Barrier(THREADS)
+
+    def worker():
+        start.wait()
+        for _ in range(attempts):
+            with app.app_context():
+                result = work()
+                db.session.commit()
+            with results_lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_spends_lose_nothing_and_stop_at_zero(app_ctx, user):
+    user_id = user.id
+    user.tokens = 200
+    db.session.commit()
+
+    results = run_threads(app_ctx, 50, lambda: counters.spend(User.tokens, user_id, 1))
+
+    charged = [row.tokens for row in results if row is not None]
+    assert len(charged) == 200
+    assert min(charged) == 0
+    assert sorted(charged) == list(range(200))  # every new balance seen exactly once
+    db.session.expire_all()
+    assert db.session.get(User, user_id).tokens == 0
+
+
+def test_concurrent_adds_are_all_counted(app_ctx, user):
+    user_id = user.id
+    user.tokens = 0
+    db.session.commit()
+
+    run_threads(app_ctx, 25, lambda: counters.add(User.tokens, user_id, 2))
+
+    db.session.expire_all()
+    assert db.session.get(User, user_id).tokens == THREADS * 25 * 2
+
+
+def test_concurrent_removals_never_go_below_the_floor(app_ctx, user):
+    user_id = user.id
+    user.votes_remaining = 10
+    db.session.commit()
+
+    results = run_threads(app_ctx, 10, lambda: counters.add(User.votes_remaining, user_id, -1, floor=0))
+
+    assert min(results) == 0
+    db.session.expire_all()
+    assert db.session.get(User, user_id).votes_remaining == 0
+
+
+def test_concurrent_votes_spend_each_vote_once(app_ctx, user):
+    author = User(email='bard@example.com', name='Bard', password=generate_password_hash('secret1'))
+    session = Session(name='Session 1')
+    db.session.add_all([author, session])
+    db.session.flush()
+    content = FanContent(title='Ballad', description='', file_path='ballad.mp3',
+                         user_id=author.id, session_id=session.id)
+    db.session.add(content)
+    user.votes_remaining = 30
+    db.session.commit()
+    user_id, content_id, author_id = user.id, content.id, author.id
+
+    clients = threading.local()
+
+    def vote():
+        if not hasattr(clients, 'client'):
+            clients.client = app_ctx.test_client()
+            clients.client.post('/login', data={'email': 'gm@example.com', 'password': 'secret1'})
+        return clients.client.post(f'/vote/{author_id}/{content_id}').status_code
+
+    statuses = run_threads(app_ctx, 10, vote)
+
+    assert set(statuses) == {302}
+    db.session.expire_all()
+    assert db.session.get(FanContent, content_id).vote_count == 30
+    assert db.session.get(User, user_id).votes_remaining == 0
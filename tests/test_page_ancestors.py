@@ -0,0 +1,52 @@
+from website import db
+from website.models import Page
+
+
+def make_chain(depth):
+    pages = []
+    parent_id = None
+    for level in range(depth):
+        page = Page(title=f'Level {level}', parent_id=parent_id)
+        db.session.add(page)
+        db.session.flush()
+        parent_id = page.id
+        pages.append(page)
+    db.session.commit()
+    return pages
+
+
+def test_ancestors_of_a_deep_chain_take_one_query(app_ctx, count_queries):
+    pages = make_chain(50)
+    leaf = pages[-1]
+    leaf.parent_id  # expired by the commit, reload it outside the count
+
+    with count_queries() as counter:
+        ancestors = leaf.get_ancestors()
+
+    assert counter.count == 1
+    assert [page.id for page in ancestors] == [page.id for page in pages[:-1]]
+
+
+def test_query_count_does_not_grow_with_depth(app_ctx, count_queries):
+    pages = make_chain(50)
+    counts = []
+    for page in (pages[1], pages[10], pages[-1]):
+        page.parent_id  # expired by the commit, reload it outside the count
+        with count_queries() as counter:
+            page.get_ancestors()
+        counts.append(counter.count)
+    assert counts == [1, 1, 1]
+
+
+def test_path_runs_from_the_root(app_ctx):
+    pages = make_chain(5)
+    assert pages[-1].get_path() == '/'.join(page.slug for page in pages)
+    assert pages[0].get_ancestors() == []
+
+
+def test_parent_cycle_terminates(app_ctx):
+    pages = make_chain(5)
+    pages[0].parent_id = pages[3].id
+    db.session.commit()
+    # Bounded by MAX_PAGE_DEPTH instead of looping forever
+    assert len(pages[2].get_ancestors()) > 0
@@ -0,0 +1,74 @@
+import random
+import re
+import time
+
+import markdown
+import pytest
+
+from website.page_editor import (CUSTOM_LINK_PATTERN, IMAGE_PATTERN, MARKDOWN_EXTENSIONS, STYLING_PATTERN,
+                                 render_markdown)
+
+MB = 1024 * 1024
+# Scanning 1 MB takes a few hundredths of a second, a pattern that backtracks takes minutes
+SCAN_SECONDS = 2
+RENDER_SECONDS = 20
+
+
+def paragraphs(text, size=2000):
+    return '\n\n'.join(text[i:i + size] for i in range(0, len(text), size))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+ADVERSARIAL = {
+    'open braces': '{' * MB,
+    'braces without colon': '{a} ' * (MB // 4),
+    'styles without close': '{a}:' * (MB // 4),
+    'link opens': '[/npc/' * (MB // 6),
+    'link long name': '[/npc/' + 'a' * MB,
+    'image opens': '![' * (MB // 2),
+    'image without close': ('![a](' + 'b' * 600) * (MB // 605),
+}
+
+
+@pytest.mark.parametrize('pattern', [CUSTOM_LINK_PATTERN, STYLING_PATTERN, IMAGE_PATTERN])
+@pytest.mark.parametrize('name', list(ADVERSARIAL))
+def test_patterns_scan_adversarial_input_in_linear_time(pattern, name):
+    compiled = re.compile(pattern)
+    assert timed(lambda: list(compiled.finditer(ADVERSARIAL[name]))) < SCAN_SECONDS
+
+
+LINEAR_DOCUMENTS = {
+    'open braces': paragraphs('{' * MB),
+    'braces without colon': paragraphs('{aaaa} ' * (MB // 7)),
+    'styles without close': paragraphs('{a}: ' + 'red ' * (MB // 4)),
+    'link long name': paragraphs('[/npc/' + 'a' * MB),
+    'image without close': paragraphs(('![a](' + 'b' * 600 + ' ') * (MB // 606)),
+    'real syntax': paragraphs('{Danger}: red, bold [/npc/old mira] ![m](m.png):10x10, left text ' * (MB // 64)),
+}
+
+
+@pytest.mark.parametrize('name', list(LINEAR_DOCUMENTS))
+def test_one_megabyte_documents_render_in_bounded_time(app, name):
+    with app.test_request_context():
+        assert timed(render_markdown, LINEAR_DOCUMENTS[name]) < RENDER_SECONDS
+
+
+def test_nested_brackets_cost_no_more_than_plain_markdown(app):
+    """Runs of `[` are quadratic in Python-Markdown's own link pattern (seconds
+    for a few KB), the wiki syntax must not add to it."""
+    random.seed(3)
+    documents = [
+        paragraphs('[/npc/' * (16 * 1024 // 6)),
+        paragraphs('![' * (4 * 1024 // 2)),
+        paragraphs(''.join(random.choice('{}[]!():,x %\t-_ab1/') for _ in range(64 * 1024))),
+    ]
+    plain = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS, output_format='html5')
+    with app.test_request_context():
+        for document in documents:
+            baseline = timed(plain.reset().convert, document)
+            assert timed(render_markdown, document) < 2 * baseline + 1
@@ -1,69 +1,338 @@
 # upload.py
-from flask import Blueprint, request, render_template, redirect, url_for, flash, send_from_directory, current_app
+from flask import Blueprint, request, render_template, redirect, url_for, flash, current_app, jsonify, abort
 import os
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.formparser import parse_form_data
+from werkzeug.exceptions import RequestEntityTooLarge
+from .media_index import index_file, unindex_file, query_media, MEDIA_SORTS, MEDIA_PAGE_SIZE, MAX_MEDIA_PAGE_SIZE, UPLOAD_TEMP_PREFIX
+from .media_derivatives import queue_derivatives, discard_derivatives, derivative_path, media_srcset, media_thumbnail, DEFAULT_SIZES
+from .media_serving import send_media, media_etag
+from .media_store import HashingFile, file_digest, has_blob, store_file, link_blob, release_blob, media_references
+from .models import MediaFile
+from . import db
+import tempfile
+import json
+import uuid
+import re
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock, chunks of one upload are not serialized there
+    fcntl = None
+
 upload = Blueprint('upload', __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mp3', 'webp', 'pdf', 'ico'}
 MAX_FILESIZE = 10 * 1024 * 1024
 B_TO_MB= 1024*1024
+# Room for the multipart boundaries and headers around the file
+MAX_UPLOAD_BODY = MAX_FILESIZE + 64 * 1024
+# Session recordings are too big for one request and go through the chunked upload
+RECORDING_EXTENSIONS = {'mp4', 'mp3', 'pdf'}
+MAX_RECORDING_SIZE = 2 * 1024 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+COPY_BUFFER = 64 * 1024
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def max_file_size(filename):
+    if filename.rsplit('.', 1)[-1].lower() in RECORDING_EXTENSIONS:
+        return MAX_RECORDING_SIZE
+    return MAX_FILESIZE
+
+#---------------------------Streaming-------------------------------------
+def receive_files(upload_folder):
+    """Parses the multipart body with every file part streamed straight into a
+    temp file inside the media folder and hashed on the way, so nothing is
+    buffered in memory or read twice, and the final move is a rename on the same
+    filesystem. Bodies over MAX_UPLOAD_BODY are refused from the Content-Length,
+    before any of it is read. The file streams have a hexdigest()."""
+    def temp_file(total_content_length, content_type, filename, content_length=None):
+        return HashingFile(tempfile.NamedTemporaryFile('wb+', dir=upload_folder, prefix=UPLOAD_TEMP_PREFIX,
+                                                       suffix='.part', delete=False))
+    _, _, files = parse_form_data(request.environ, stream_factory=temp_file,
+                                  max_content_length=MAX_UPLOAD_BODY)
+    return files
+
+def discard_files(files):
+    """Removes whatever temp files of the request were not published."""
+    for file in files.values():
+        file.stream.close()
+        if os.path.exists(file.stream.name):
+            os.remove(file.stream.name)
+
 @upload.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload_file():
     upload_folder = current_app.config['UPLOAD_FOLDER']
     if request.method == 'POST':
-        if 'media' not in request.files:
-            flash(message='No file part', category='error')
+        try:
+            files = receive_files(upload_folder)
+        except RequestEntityTooLarge:
+            flash(message=f'File size exceeds {MAX_FILESIZE/B_TO_MB}MB limit', category='error')
             return redirect(request.url)
-        file = request.files['media']
-        if file.filename == '':
-            flash(message='No selected file', category='error')
-            return redirect(request.url)
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # --- 1. Check file size (10 MB limit) ---
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()  
-            file.seek(0)  
-            if file_size > MAX_FILESIZE:
-                flash(message=f'File size exceeds {MAX_FILESIZE/B_TO_MB}MB limit', category='error')
+        try:
+            if 'media' not in files:
+                flash(message='No file part', category='error')
                 return redirect(request.url)
-            # --- 2. Check if file already exists ---
-            file_path = os.path.join(upload_folder, filename)
-            if os.path.exists(file_path):
-                flash(message='A file with that name already exists', category='error')
+            file = files['media']
+            if file.filename == '':
+                flash(message='No selected file', category='error')
                 return redirect(request.url)
-            # Save the file
-            file.save(file_path)
-            flash(message='File successfully uploaded', category='success')
-            return redirect(url_for('upload.upload_file'))
-        else:
-            flash(message='File type not allowed', category='error')
-            return render_template('upload.html', user=current_user)
+            if file and allowed_file(file.filename):
+                filename = secure_filename(file.filename)
+                # The body was already cut off past MAX_UPLOAD_BODY, this catches
+                # files that only just fit with the form around them
+                if os.path.getsize(file.stream.name) > MAX_FILESIZE:
+                    flash(message=f'File size exceeds {MAX_FILESIZE/B_TO_MB}MB limit', category='error')
+                    return redirect(request.url)
+                file.stream.close()
+                digest = file.stream.hexdigest()
+                if not store_file(file.stream.name, upload_folder, filename, digest):
+                    flash(message='A file with that name already exists', category='error')
+                    return redirect(request.url)
+                index_file(upload_folder, filename, digest)
+                db.session.commit()
+                queue_derivatives(filename)
+                flash(message='File successfully uploaded', category='success')
+                return redirect(url_for('upload.upload_file'))
+            else:
+                flash(message='File type not allowed', category='error')
+                return render_template('upload.html', user=current_user)
+        finally:
+            discard_files(files)
     accept_string = ",".join(f".{ext.lower()}" for ext in ALLOWED_EXTENSIONS)
-    media_files = sorted(os.listdir(upload_folder))
-    return render_template('upload.html', user=current_user, accept_string=accept_string, media_files=media_files)
+    media_files, next_cursor = get_media_page('name', 'asc')
+    return render_template('upload.html', user=current_user, accept_string=accept_string, media_files=media_files, next_cursor=next_cursor,
+                           max_filesize=MAX_FILESIZE, chunked_types=",".join(sorted(RECORDING_EXTENSIONS)))
+
+#---------------------------Chunked uploads-------------------------------------
+# A chunked upload lives in the media folder as <prefix><id>.part (the bytes so
+# far) and <prefix><id>.json (target name, total size, owner) until its last
+# chunk arrives, so an interrupted upload can resume from the .part size.
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def chunked_upload_paths(upload_folder, upload_id):
+    base = os.path.join(upload_folder, f'{UPLOAD_TEMP_PREFIX}{upload_id}')
+    return base + '.part', base + '.json'
+
+def lock_part(part):
+    """Holds an exclusive lock on an open part file until it is closed, across
+    threads and worker processes."""
+    if fcntl is not None:
+        fcntl.flock(part.fileno(), fcntl.LOCK_EX)
+
+def load_chunked_upload(upload_folder, upload_id):
+    """Returns (part path, info path, info) of the current user's chunked upload, or None."""
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        return None
+    part_path, info_path = chunked_upload_paths(upload_folder, upload_id)
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('user_id') != current_user.id or not os.path.exists(part_path):
+        return None
+    return part_path, info_path, info
+
+@upload.route('/upload/chunked', methods=['POST'])
+@login_required
+def start_chunked_upload():
+    """Starts a resumable upload from {filename, size}, the chunks then go to PUT /upload/chunked/<upload_id>."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    size = data.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'Invalid size'}), 400
+    if size > max_file_size(filename):
+        return jsonify({'error': f'File size exceeds {max_file_size(filename)/B_TO_MB}MB limit'}), 413
+    if os.path.exists(os.path.join(upload_folder, filename)):
+        return jsonify({'error': 'A file with that name already exists'}), 409
+
+    upload_id = uuid.uuid4().hex
+    part_path, info_path = chunked_upload_paths(upload_folder, upload_id)
+    open(part_path, 'wb').close()
+    with open(info_path, 'w') as f:
+        json.dump({'filename': filename, 'size': size, 'user_id': current_user.id}, f)
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'chunk_size': CHUNK_SIZE}), 201
+
+@upload.route('/upload/chunked/<upload_id>', methods=['GET'])
+@login_required
+def chunked_upload_status(upload_id):
+    """How much of the upload arrived, a client resumes by sending the chunk at `offset`."""
+    pending = load_chunked_upload(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if pending is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    part_path, _, info = pending
+    return jsonify({'offset': os.path.getsize(part_path), 'size': info['size'], 'filename': info['filename']})
+
+@upload.route('/upload/chunked/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Appends the request body at ?offset=, which has to be where the upload
+    currently ends. The body is streamed to disk COPY_BUFFER bytes at a time and
+    the upload is published once the last byte is in."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    pending = load_chunked_upload(upload_folder, upload_id)
+    if pending is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    part_path, info_path, info = pending
+    request.max_content_length = CHUNK_SIZE
+    if request.content_length is not None and request.content_length > CHUNK_SIZE:
+        return jsonify({'error': f'Chunks are at most {CHUNK_SIZE} bytes'}), 413
+
+    try:
+        # r+b, a request that lost the race to the last chunk must not recreate the file
+        part = open(part_path, 'r+b')
+    except FileNotFoundError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    with part:
+        # Two PUTs at the same offset would both pass the check and both append
+        lock_part(part)
+        if not os.path.exists(info_path):
+            return jsonify({'error': 'Unknown upload'}), 404
+        received = os.fstat(part.fileno()).st_size
+        if request.args.get('offset', type=int) != received:
+            return jsonify({'error': 'Offset mismatch', 'offset': received}), 409
+        remaining = info['size'] - received
+        part.seek(received)
+        try:
+            while True:
+                data = request.stream.read(COPY_BUFFER)
+                if not data:
+                    break
+                if len(data) > remaining:
+                    part.truncate(received)
+                    return jsonify({'error': 'Chunk runs past the file size', 'offset': received}), 400
+                part.write(data)
+                remaining -= len(data)
+        except RequestEntityTooLarge:
+            part.truncate(received)
+            return jsonify({'error': f'Chunks are at most {CHUNK_SIZE} bytes'}), 413
+        part.flush()
+        offset = info['size'] - remaining
+        if remaining:
+            return jsonify({'offset': offset, 'done': False})
+
+        # Still under the lock, so only one request publishes the upload
+        os.remove(info_path)
+        # Chunks arrive over many requests, possibly to other workers, so the hash is taken at the end
+        digest = file_digest(part_path)
+        if not store_file(part_path, upload_folder, info['filename'], digest):
+            return jsonify({'error': 'A file with that name already exists'}), 409
+    index_file(upload_folder, info['filename'], digest)
+    db.session.commit()
+    # Big images are what the chunked upload is for, they get their WebP copies too
+    queue_derivatives(info['filename'])
+    return jsonify({'offset': offset, 'done': True, 'filename': info['filename']})
+
+@upload.route('/upload/link', methods=['POST'])
+@login_required
+def link_upload():
+    """Uploads {filename, digest} without sending the bytes, when content with that
+    sha256 is stored already. 404 means the client has to send the file."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename') or ''))
+    digest = str(data.get('digest') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    if not DIGEST_PATTERN.match(digest) or not has_blob(upload_folder, digest):
+        return jsonify({'error': 'Unknown content'}), 404
+    if not link_blob(upload_folder, filename, digest):
+        return jsonify({'error': 'A file with that name already exists'}), 409
+    index_file(upload_folder, filename, digest)
+    db.session.commit()
+    queue_derivatives(filename)
+    flash(message='File successfully uploaded', category='success')
+    return jsonify({'filename': filename}), 201
+
+@upload.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_chunked_upload(upload_id):
+    pending = load_chunked_upload(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if pending is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    for path in pending[:2]:
+        os.remove(path)
+    return jsonify({'success': True})
+
+def get_media_page(default_sort, default_order):
+    """Reads sort, order, cursor, limit and kind from the query string and returns
+    (MediaFile rows, next cursor) from the media index. A bad cursor restarts
+    from the first page."""
+    sort = request.args.get('sort', default_sort)
+    if sort not in MEDIA_SORTS:
+        sort = default_sort
+    descending = request.args.get('order', default_order) == 'desc'
+    limit = request.args.get('limit', MEDIA_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_MEDIA_PAGE_SIZE))
+    kind = request.args.get('kind')
+    try:
+        return query_media(sort, descending, request.args.get('cursor'), limit, kind)
+    except ValueError:
+        return query_media(sort, descending, None, limit, kind)
 
 @upload.route('/browse')
 @login_required
 def browse_media():
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    media_files = sorted(
-    os.listdir(upload_folder),
-    key=lambda f: os.path.getmtime(os.path.join(upload_folder, f)),
-    reverse=True)
-    return render_template('browse_media.html', media_files=media_files,user=current_user)
+    media_files, next_cursor = get_media_page('mtime', 'desc')
+    return render_template('browse_media.html', media_files=media_files, next_cursor=next_cursor, user=current_user)
+
+@upload.route('/api/media')
+@login_required
+def media_api():
+    """One page of the media index as JSON, see get_media_page for the parameters."""
+    media_files, next_cursor = get_media_page('mtime', 'desc')
+    media = [{
+        'filename': media.filename,
+        'url': url_for('upload.media_file', filename=media.filename),
+        'size': media.size,
+        'mtime': media.mtime.isoformat(),
+        'mime': media.mime,
+        'width': media.width,
+        'height': media.height,
+        'thumbnail': media_thumbnail(media.filename),
+        'srcset': media_srcset(media.filename),
+    } for media in media_files]
+    return jsonify({'media': media, 'next': next_cursor})
 
 @upload.route('/media/<filename>')
 @login_required
 def media_file(filename):
     upload_folder = current_app.config['UPLOAD_FOLDER']
-    return send_from_directory(upload_folder, filename)
+    path = safe_join(upload_folder, filename)
+    etag = media_etag(filename, path) if path and os.path.isfile(path) else None
+    return send_media(upload_folder, filename, etag=etag)
+
+DERIVATIVE_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}-[0-9]+\.webp$')
+
+@upload.route('/media/derivatives/<name>')
+@login_required
+def media_derivative(name):
+    if not DERIVATIVE_NAME_PATTERN.match(name):
+        abort(404)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = os.path.relpath(derivative_path(upload_folder, name), upload_folder)
+    return send_media(upload_folder, path, etag=name.rsplit('.', 1)[0], immutable=True)
+
+@upload.route('/media/thumbnail/<filename>')
+@login_required
+def media_thumbnail_file(filename):
+    """Redirects to the smallest derivative of an image, for scripts that only know the file name."""
+    return redirect(media_thumbnail(filename))
+
+upload.add_app_template_global(media_srcset)
+upload.add_app_template_global(media_thumbnail)
+upload.add_app_template_global(DEFAULT_SIZES, 'media_sizes')
 
 @upload.route('/delete', methods=['POST'])
 @login_required
@@ -73,9 +342,20 @@ def delete_file():
         flash('No filename provided', 'error')
         return redirect(url_for('upload.upload_file'))
 
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(file_path):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    file_path = os.path.join(upload_folder, filename)
+    references = media_references(filename)
+    if references:
+        used_by = ', '.join(f'{source} ({uses})' for source, uses in references.items())
+        flash(f'{filename} is still used by {used_by}.', 'error')
+    elif os.path.exists(file_path):
         os.remove(file_path)
+        digest = db.session.query(MediaFile.digest).filter_by(filename=filename).scalar()
+        unindex_file(filename)
+        db.session.commit()
+        # The content goes once no other name shares it
+        if release_blob(upload_folder, digest):
+            discard_derivatives(upload_folder, [digest])
         flash(f'{filename} deleted successfully.', 'success')
     else:
         flash('File not found.', 'error')
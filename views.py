@@ -1,16 +1,58 @@
-from flask import Blueprint, render_template, flash, request, redirect, url_for
+from flask import Blueprint, render_template, flash, request, redirect, url_for, jsonify, Response
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from .models import Page, Session, Comment, FanContent, User
+from .models import Page, Session, Comment, FanContent, User, MODELS
+from .page_tree import get_page_tree, get_tree_json
+from .comment_tree import load_comment_threads
+from .media_derivatives import media_thumbnail
+from .search_index import search, SEARCH_FIELDS, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE, MAX_RANKED_MATCHES
+from .autocomplete import autocomplete, AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT
+from .page_editor import extract_custom_links
+from .manage_entries import resolve_entries_by_name
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.orm import aliased
 from datetime import datetime
-from . import db
+from . import db, counters
 
 
 views = Blueprint('views', __name__)
 
 SHOWN_SESSIONS=3
+SESSIONS_PAGE_SIZE = 10
+MAX_SESSIONS_PAGE_SIZE = 50
+# The session browser only shows previews of these Text columns
+DESCRIPTION_PREVIEW_LENGTH = 150
+NOTES_PREVIEW_LENGTH = 500
 
 
+def get_top_fan_content(session_ids, per_session):
+    """Returns session id -> [(FanContent, User), ...] with the `per_session` most
+    voted contents of each session (only ones with votes), best first. Ranks every
+    session at once with ROW_NUMBER() instead of one query per session."""
+    if not session_ids:
+        return {}
+    rank = func.row_number().over(
+        partition_by=FanContent.session_id,
+        order_by=(FanContent.vote_count.desc(), FanContent.id)
+    ).label('rank')
+    ranked = (
+        select(FanContent, rank)
+        .where(FanContent.session_id.in_(session_ids), FanContent.vote_count > 0)
+        .subquery()
+    )
+    content = aliased(FanContent, ranked)
+    rows = (
+        db.session.query(content, User)
+        .join(User, User.id == content.user_id)
+        .filter(ranked.c.rank <= per_session)
+        .order_by(content.session_id, ranked.c.rank)
+        .all()
+    )
+    top_content = {}
+    for fan_content, author in rows:
+        top_content.setdefault(fan_content.session_id, []).append((fan_content, author))
+    return top_content
+
 
 @views.route('/')
 @login_required
@@ -22,7 +64,6 @@ def home():
     past_sessions = Session.query.filter(Session.session_date < now).order_by(Session.session_date.desc()).limit(SHOWN_SESSIONS).all()
     fan_content_for_previous=None
     session_with_winners= []
-    winner=None
     if past_sessions:
         previous_session = past_sessions[0]
         fan_content_for_previous = (
@@ -30,12 +71,10 @@ def home():
             .filter_by(session_id=previous_session.id)
             .all()
         )
+        top_content = get_top_fan_content([session.id for session in past_sessions], 1)
         for session in past_sessions:
-            top_content = FanContent.query.filter(FanContent.session_id == session.id,FanContent.vote_count > 0).order_by(FanContent.vote_count.desc()).first()
-            if top_content:
-                winner = User.query.get(top_content.user_id)
-            else:
-                winner=None
+            winners = top_content.get(session.id)
+            winner = winners[0][1] if winners else None
             session_with_winners.append({"session": session,"winner": winner})
     return render_template('home.html', user=current_user, upcoming_sessions=upcoming_sessions, session_w=session_with_winners, fan_content=fan_content_for_previous)
 
@@ -43,14 +82,14 @@ def home():
 @login_required
 def vote(content_user_id, content_id):
     content = FanContent.query.get_or_404(content_id)
-    if current_user.votes_remaining <= 0:
-        flash(message="You have no votes left!", category="error")
-        return redirect(url_for("views.home"))
     if content_user_id == current_user.id:
         flash(message="You cannot vote for your own content!", category="error")
         return redirect(url_for("views.home"))
-    current_user.votes_remaining -= 1
-    content.vote_count += 1
+    if counters.spend(User.votes_remaining, current_user.id, 1) is None:
+        db.session.rollback()
+        flash(message="You have no votes left!", category="error")
+        return redirect(url_for("views.home"))
+    counters.add(FanContent.vote_count, content.id, 1)
     db.session.commit()
     flash("Your vote has been recorded!", "success")
     return redirect(url_for("views.home"))
@@ -58,13 +97,66 @@ def vote(content_user_id, content_id):
 @views.route("/browse-sessions")
 @login_required
 def browse_sessions():
-    now=datetime.now()
-    past_sessions = Session.query.filter(Session.session_date < now).order_by(Session.session_date.desc()).all()
-    fan_content_for_all = []
-    for session in past_sessions:
-            top_contents=FanContent.query.filter(FanContent.session_id == session.id,FanContent.vote_count > 0).order_by(FanContent.vote_count.desc()).limit(3).all()
-            fan_content_for_all.append({"session":session, "memes":top_contents})
-    return render_template('sessions.html', user=current_user, sessions=fan_content_for_all)
+    # Only the first page is rendered, the rest is scrolled in from /api/sessions
+    sessions, next_cursor = get_past_sessions_page(None, SESSIONS_PAGE_SIZE)
+    return render_template('sessions.html', user=current_user, sessions=sessions, next_cursor=next_cursor)
+
+@views.route("/api/sessions")
+@login_required
+def sessions_api():
+    """One page of past sessions, newest first. `cursor` is the `next` value of the previous page."""
+    limit = request.args.get('limit', SESSIONS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_SESSIONS_PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_date, cursor_id = cursor.rsplit('_', 1)
+            cursor = (datetime.fromisoformat(cursor_date), int(cursor_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    sessions, next_cursor = get_past_sessions_page(cursor, limit)
+    data = []
+    for sw in sessions:
+        session = dict(sw["session"])
+        session['session_date'] = session['session_date'].strftime("%b %d, %Y")
+        session['image'] = media_thumbnail(session['image']) if session['image'] else None
+        session['memes'] = [{
+            'url': url_for('upload.media_file', filename=meme.file_path),
+            'thumbnail': media_thumbnail(meme.file_path),
+        } for meme in sw["memes"]]
+        data.append(session)
+    return jsonify({'sessions': data, 'next': next_cursor})
+
+def preview_text(text, length):
+    if text is None:
+        return None
+    return text[:length] + ('...' if len(text) > length else '')
+
+def get_past_sessions_page(cursor, limit):
+    """Returns ([{"session", "memes"}], next cursor) for up to `limit` past sessions
+    older than `cursor` ((session_date, id) of the last session shown). Only the
+    summary columns are loaded, with description and notes cut down to previews
+    in SQL, so a page costs the same however long the session notes get."""
+    query = db.session.query(
+        Session.id, Session.name, Session.session_no, Session.campaign_name,
+        Session.session_date, Session.image,
+        func.substr(Session.description, 1, DESCRIPTION_PREVIEW_LENGTH + 1).label('description'),
+        func.substr(Session.notes, 1, NOTES_PREVIEW_LENGTH + 1).label('notes'),
+    ).filter(Session.session_date < datetime.now())
+    if cursor:
+        query = query.filter(tuple_(Session.session_date, Session.id) < tuple_(*cursor))
+    rows = query.order_by(Session.session_date.desc(), Session.id.desc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    top_content = get_top_fan_content([row.id for row in rows], 3)
+    sessions = []
+    for row in rows:
+        session = row._asdict()
+        session['description'] = preview_text(row.description, DESCRIPTION_PREVIEW_LENGTH)
+        session['notes'] = preview_text(row.notes, NOTES_PREVIEW_LENGTH)
+        sessions.append({"session": session, "memes": [content for content, _ in top_content.get(row.id, [])]})
+    next_cursor = f'{rows[-1].session_date.isoformat()}_{rows[-1].id}' if more else None
+    return sessions, next_cursor
 
 """ @views.route('/character')
 @login_required
@@ -72,17 +164,76 @@ def character():
     
     return render_template('character.html', user=current_user)
  """
+@views.route('/search')
+@login_required
+def search_page():
+    query, model, page, limit = read_search_args()
+    results, more, truncated = search(query, page, limit, model)
+    return render_template('search.html', user=current_user, query=query, model=model, page=page,
+                           results=results, more=more, truncated=truncated, max_ranked=MAX_RANKED_MATCHES,
+                           models=SEARCH_FIELDS, pages=get_page_tree())
+
+@views.route('/api/search')
+@login_required
+def search_api():
+    """Ranked search over pages and entries. `q` is the query, `model` keeps one model, `page` is 1 based.
+    `truncated` is true when only the newest matches were ranked."""
+    query, model, page, limit = read_search_args()
+    results, more, truncated = search(query, page, limit, model)
+    return jsonify({'results': results, 'page': page, 'more': more, 'truncated': truncated})
+
+def read_search_args():
+    query = request.args.get('q', '').strip()
+    model = request.args.get('model')
+    if model not in SEARCH_FIELDS:
+        model = None
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = request.args.get('limit', SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    return query, model, page, limit
+
+@views.route('/autocomplete/<model_name>')
+@login_required
+def autocomplete_api(model_name):
+    """Typeahead for the editors: entries of a model whose name/title or slug starts with `q`."""
+    model = MODELS.get(model_name.lower())
+    if not model:
+        return jsonify({'error': 'Invalid model'}), 400
+    limit = request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_AUTOCOMPLETE_LIMIT))
+    return jsonify({'results': autocomplete(model, request.args.get('q', ''), limit)})
+
 @views.route('/wiki')
 @login_required
 def wiki_index():
-    root_pages = Page.query.filter_by(parent_id=None).order_by(Page.title).all()
+    root_pages = get_page_tree()
     return render_template("wiki/index.html",page=None, pages=root_pages, user=current_user)
 
+@views.route('/api/pages/tree')
+@login_required
+def page_tree_api():
+    root = request.args.get('root', type=int)
+    depth = request.args.get('depth', type=int)
+    if depth is not None and depth < 0:
+        return jsonify({'error': 'Depth must be a positive number'}), 400
+
+    tree = get_tree_json(root, depth)
+    if tree is None:
+        return jsonify({'error': 'Page not found'}), 404
+
+    body, etag = tree
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Always revalidate, an unchanged tree is answered with a bodiless 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @views.route('/wiki/<slug>', methods=['GET', 'POST'])
 @login_required
 def view_page(slug):
     page = Page.query.filter_by(slug=slug).first_or_404()
-    root_pages = Page.query.filter_by(parent_id=None).order_by(Page.title).all()
+    root_pages = get_page_tree()
     if request.method == 'POST':
         text = request.form.get('text')
         parent_id = request.form.get('parent_id') or None
@@ -101,12 +252,23 @@ def view_page(slug):
         db.session.commit()
         return redirect(url_for('views.view_page', slug=slug))
 
-    comments = Comment.query.filter_by(page_id=page.id, parent_id=None) \
-                            .order_by(Comment.created_at.asc()) \
-                            .all()
-    
+    # ?comments=<cursor> pages through the top-level threads, ?thread=<id> shows
+    # a single thread, used to continue threads nested too deep for the page
+    thread_id = request.args.get('thread', type=int)
+    cursor = request.args.get('comments')
+    if cursor:
+        try:
+            cursor_time, cursor_id = cursor.rsplit('_', 1)
+            cursor = (datetime.fromisoformat(cursor_time), int(cursor_id))
+        except ValueError:
+            cursor = None
+    comments, next_comments = load_comment_threads(page.id, cursor, thread_id=thread_id)
+    next_comments = f'{next_comments[0].isoformat()}_{next_comments[1]}' if next_comments else None
+
+    # Everything the link tooltips need, so hovering them costs no request
+    tooltip_data = resolve_entries_by_name(extract_custom_links(page.content))
 
-    return render_template('wiki/view_page.html', page=page, slug=slug, pages=root_pages, user=current_user, comments=comments)
+    return render_template('wiki/view_page.html', page=page, slug=slug, pages=root_pages, user=current_user, comments=comments, next_comments=next_comments, thread_id=thread_id, tooltip_data=tooltip_data)
 
 @views.route('/comment/delete/<int:comment_id>', methods=['POST'])
 @login_required